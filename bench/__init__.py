@@ -0,0 +1 @@
+'''Benchmarks for Flora's format codecs. Run with `python -m bench.run` from Flora's main directory.'''
@@ -0,0 +1,191 @@
+'''Deterministic synthetic corpus for the benchmarks'''
+import random
+
+from PIL import Image
+
+def palette(rng, num_colors):
+    """
+    Random RGB888 palette (as a flat list, like PIL expects) with colors that survive the conversion to BGR555.
+    """
+    return [rng.randrange(32) * 8 for _ in range(num_colors * 3)]
+
+def tilemap_image(rng, width, height, num_tiles = 64, num_colors = 256):
+    """
+    Random indexed image of `width`x`height` tiles, built from a set of `num_tiles` unique tiles (like real backgrounds, which repeat a lot of tiles).
+    """
+    tiles = [bytes(rng.randrange(num_colors) for _ in range(64)) for _ in range(num_tiles)]
+    out = bytearray(width * height * 64)
+    for y in range(height):
+        for x in range(width):
+            tile = rng.choice(tiles)
+            for row in range(8):
+                pos = (y * 8 + row) * width * 8 + x * 8
+                out[pos:pos+8] = tile[row*8:row*8+8]
+    img = Image.frombytes("P", (width * 8, height * 8), bytes(out))
+    img.putpalette(palette(rng, num_colors))
+    return img
+
+def text(rng, length):
+    """
+    Random text-like ASCII bytes (words, punctuation and the odd line break), so that it compresses about as well as game text does.
+    """
+    words = ["the", "puzzle", "Layton", "Luke", "hint", "answer", "village", "a", "is", "of", "and", "to", "you", "this"]
+    out = []
+    size = 0
+    while size < length:
+        word = rng.choice(words) + rng.choice([" ", " ", " ", ", ", ". ", "\n"])
+        out.append(word)
+        size += len(word)
+    return "".join(out)[:length].encode("ascii")
+
+def pcm_members(rng, num_files, min_size = 16, max_size = 2048):
+    """
+    Names and contents for a PCM with `num_files` members.
+    """
+    names = [f"t_{i}.txt" for i in range(num_files)]
+    files = [text(rng, rng.randint(min_size, max_size)) for _ in range(num_files)]
+    return files, names
+
+def gds_commands(rng, num_commands):
+    """
+    Random GDS commands, with every parameter type supported by GDS.to_gds.
+    """
+    cmds = []
+    for _ in range(num_commands):
+        params = []
+        for _ in range(rng.randint(0, 6)):
+            p_type = rng.choice(["int", "int", "unknown-2", "string", "unknown-6", "unknown-7", "unknown-8", "unknown-9", "unknown-b"])
+            if p_type == "string":
+                params.append({"type": p_type, "data": text(rng, rng.randint(1, 32)).decode("ascii").replace("\n", " ")})
+            elif p_type in ("unknown-8", "unknown-9", "unknown-b"):
+                params.append({"type": p_type})
+            else:
+                params.append({"type": p_type, "data": rng.randrange(2**32)})
+        cmds.append({"command": rng.randrange(1, 0x100), "parameters": params})
+    return cmds
+
+def repetitive_gds_edit(rng, num_commands, num_edits, num_distinct = 4):
+    """
+    A long GDS script made of only a few different commands, and a copy of it with `num_edits` commands removed, added or changed.
+    Almost no command is unique, so diffing them can't rely on a patience diff.
+    """
+    pool = gds_commands(rng, num_distinct)
+    cmds = [rng.choice(pool) for _ in range(num_commands)]
+    edited = list(cmds)
+    for _ in range(num_edits):
+        pos = rng.randrange(len(edited))
+        edit = rng.randrange(3)
+        if edit == 0:
+            del edited[pos]
+        elif edit == 1:
+            edited.insert(pos, rng.choice(pool))
+        else:
+            edited[pos] = rng.choice(pool)
+    return cmds, edited
+
+def sprite_images(rng, num_images, bpp = 4):
+    """
+    Images and info (like `ANI.to_json()` gives) for an ANI sprite with `num_images` images of random sizes, sharing one palette.
+    Every image has a transparent border, so that some of its parts are empty, like real sprites.
+    """
+    num_colors = 16 if bpp == 4 else 256
+    pal = palette(rng, num_colors)
+    images = []
+    for _ in range(num_images):
+        width, height = rng.randrange(1, 9) * 8, rng.randrange(1, 9) * 8
+        img = Image.new("P", (width, height))
+        border = rng.randrange(0, 2) * 8
+        pixels = bytes(rng.randrange(1, num_colors) for _ in range(max(width - 2*border, 0) * max(height - 2*border, 0)))
+        if pixels:
+            img.paste(Image.frombytes("P", (width - 2*border, height - 2*border), pixels), (border, border))
+        img.putpalette(pal)
+        images.append(img)
+    info = {"header": 2, "bpp": bpp, "images": [{"unknown": 0} for _ in images], "animation_data": ""}
+    return images, info
+
+def rle_compress(data):
+    """
+    Simple RLE compressor, since Flora can only decompress RLE.
+    """
+    out = bytearray((0x30 | len(data) << 8).to_bytes(4, "little"))
+    pos = 0
+    literal = bytearray()
+    def flush():
+        while literal:
+            chunk = literal[:0x80]
+            out.append(len(chunk) - 1)
+            out.extend(chunk)
+            del literal[:0x80]
+    while pos < len(data):
+        run = 1
+        while pos + run < len(data) and run < 0x82 and data[pos + run] == data[pos]:
+            run += 1
+        if run >= 3:
+            flush()
+            out.append(0x80 | (run - 3))
+            out.append(data[pos])
+            pos += run
+        else:
+            literal.append(data[pos])
+            pos += 1
+    flush()
+    while len(out) % 4:
+        out.append(0)
+    return bytes(out)
+
+def lz11_compress(data):
+    """
+    Simple (greedy) LZ11 compressor, since Flora can only decompress LZ11. Uses all three ways of storing a back-reference's length.
+    Empty (or huge) data uses the 8-byte header, since a size of 0 in the normal header means the size is in the next 4 bytes.
+    """
+    size = len(data)
+    if 0 < size < 1 << 24:
+        out = bytearray((0x11 | size << 8).to_bytes(4, "little"))
+    else:
+        out = bytearray(b"\x11\x00\x00\x00" + size.to_bytes(4, "little"))
+    last = {} # 3 bytes -> last position they were seen at
+    pos = 0
+    while pos < size:
+        flags_pos = len(out)
+        out.append(0)
+        for bit in range(8):
+            if pos >= size:
+                break
+            start = last.get(data[pos:pos+3])
+            length = 0
+            if start is not None and pos - start <= 0x1000:
+                while pos + length < size and length < 0x10110 and data[start + length] == data[pos + length]:
+                    length += 1
+            for i in range(pos, pos + max(length, 1)):
+                last[data[i:i+3]] = i
+            if length < 3:
+                out.append(data[pos])
+                pos += 1
+                continue
+            out[flags_pos] |= 0x80 >> bit
+            disp = pos - start - 1
+            if length <= 0x10:
+                out += bytes(((length - 1) << 4 | disp >> 8, disp & 0xFF))
+            elif length <= 0x110:
+                n = length - 0x11
+                out += bytes((n >> 4, (n & 0xF) << 4 | disp >> 8, disp & 0xFF))
+            else:
+                n = length - 0x111
+                out += bytes((0x10 | n >> 12, n >> 4 & 0xFF, (n & 0xF) << 4 | disp >> 8, disp & 0xFF))
+            pos += length
+    return bytes(out)
+
+def generate(seed = 0, scale = 1):
+    """
+    Builds the whole corpus. `scale` multiplies the amount of files of each kind.
+    """
+    rng = random.Random(seed)
+    return {
+        "bg": [tilemap_image(rng, 32, 24, rng.choice([16, 64, 256])) for _ in range(4 * scale)],
+        "pcm": [pcm_members(rng, n) for n in (10, 50, 200) for _ in range(scale)],
+        "gds": [gds_commands(rng, n) for n in (10, 100, 1000) for _ in range(scale)],
+        "rle": [bytes(rng.choice([0, 0, 0, rng.randrange(256)]) for _ in range(1 << 16)) for _ in range(2 * scale)],
+        # Last, so that adding it didn't change the rest of the corpus
+        "gds_repetitive": [repetitive_gds_edit(rng, n, n // 100) for n in (2000, 20000) for _ in range(scale)],
+        "ani": [sprite_images(rng, n, bpp) for n, bpp in ((4, 4), (16, 4), (16, 8)) for _ in range(scale)],
+    }
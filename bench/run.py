@@ -0,0 +1,173 @@
+'''Benchmark harness: measures throughput and peak memory of every decode and encode path'''
+import click
+import io
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from ndspy import lz10
+
+from bench import corpus
+from formats import ani, bg, compression, gdsdiff, rawimage
+from formats.gds import GDS
+from formats.pcm import PCM
+from version import v
+
+def cases(data):
+    """
+    Returns every benchmark case as (name, inputs, function, size function), where the function is called once per input
+    and the size function gives the amount of bytes processed for that input (for the MB/s figure).
+    """
+    arcs = [bg.from_image(img) for img in data["bg"]]
+    pcms = [PCM(files, names).file for files, names in data["pcm"]]
+    pcms_lz = [lz10.compress(pcm) for pcm in pcms]
+    gds_json = [json.dumps({"version": v, "data": cmds}) for cmds in data["gds"]]
+    gds_bin = [GDS(j, "json").to_bin() for j in gds_json]
+    rle = [corpus.rle_compress(d) for d in data["rle"]]
+    pcms_lz11 = [corpus.lz11_compress(pcm) for pcm in pcms]
+    # Two edited versions of every script: one with every 8th command dropped, one with every 16th command's parameters dropped
+    gds_edits = [(cmds, [c for i, c in enumerate(cmds) if i % 8], [dict(c, parameters=[]) if i % 16 == 0 else c for i, c in enumerate(cmds)])
+                 for cmds in data["gds"]]
+
+    def pcm_members(pcm):
+        pcm = PCM(pcm)
+        return [pcm[name] for name in pcm.offsets]
+
+    def pcm_replace(pcm):
+        pcm = PCM(pcm)
+        for name in list(pcm.offsets)[::4]:
+            pcm.replace(name, pcm[name] + b"!")
+
+    def pcm_replace_many(pcm):
+        pcm = PCM(pcm)
+        pcm.replace_many({name: pcm[name] + b"!" for name in list(pcm.offsets)[::4]})
+
+    def png_encode(img):
+        img.save(io.BytesIO(), "PNG")
+
+    def png_fast_encode(img):
+        img.save(io.BytesIO(), "PNG", compress_level=1)
+
+    def raw_write(img):
+        rawimage.write_raw(io.BytesIO(), img)
+
+    decoded = [bg.to_image(arc) for arc in arcs]
+    sprites = [ani.from_images(list(images), info) for images, info in data["ani"]]
+
+    def ani_decode(file):
+        sprite = ani.ANI(file)
+        return [sprite.pixels(i) for i in range(len(sprite))]
+
+    return [
+        ("bg.decode", arcs, bg.to_image, len),
+        ("bg.thumbnail", arcs, bg.thumbnail, len),
+        ("bg.encode", data["bg"], bg.from_image, lambda img: img.size[0] * img.size[1]),
+        ("bg.png_encode", decoded, png_encode, lambda img: img.size[0] * img.size[1]),
+        ("bg.png_fast_encode", decoded, png_fast_encode, lambda img: img.size[0] * img.size[1]),
+        ("bg.raw_write", decoded, raw_write, lambda img: img.size[0] * img.size[1]),
+        ("ani.decode", sprites, ani_decode, len),
+        ("ani.encode", data["ani"], lambda s: ani.from_images(list(s[0]), s[1]), lambda s: sum(img.size[0] * img.size[1] for img in s[0])),
+        ("pcm.encode", data["pcm"], lambda p: PCM(*p), lambda p: sum(len(f) for f in p[0])),
+        ("pcm.decode", pcms, pcm_members, len),
+        ("pcm.replace", pcms, pcm_replace, len),
+        ("pcm.replace_many", pcms, pcm_replace_many, len),
+        ("gds.decode", gds_bin, GDS, len),
+        ("gds.encode", gds_json, lambda j: GDS(j, "json").to_bin(), len),
+        ("gds.to_json", [GDS(b) for b in gds_bin], GDS.to_json, lambda g: len(g.to_bin())),
+        ("gds.diff", gds_edits, lambda e: gdsdiff.diff(e[0], e[1]), lambda e: len(GDS(json.dumps({"data": e[0]}), "json").to_bin())),
+        ("gds.diff_repetitive", data["gds_repetitive"], lambda e: gdsdiff.diff(*e), lambda e: len(GDS(json.dumps({"data": e[0]}), "json").to_bin())),
+        ("gds.merge3", gds_edits, lambda e: gdsdiff.merge3(*e), lambda e: len(GDS(json.dumps({"data": e[0]}), "json").to_bin())),
+        ("lz10.decompress", pcms_lz, compression.decompress, len),
+        ("lz10.decompress_ndspy", pcms_lz, lz10.decompress, len),
+        ("lz11.decompress", pcms_lz11, compression.decompress, len),
+        ("lz10.compress", pcms, lz10.compress, len),
+        ("rle.decompress", rle, compression.rle.decompress, len),
+    ]
+
+def measure(inputs, fn, size, repeat):
+    total_bytes = sum(size(i) for i in inputs)
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in inputs:
+            fn(i)
+        times.append(time.perf_counter() - start)
+
+    # Peak memory is measured on a separate run, since tracemalloc slows everything down
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    peak = 0
+    for i in inputs:
+        tracemalloc.reset_peak()
+        fn(i)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    best = min(times)
+    return {
+        "files": len(inputs),
+        "bytes": total_bytes,
+        "best_s": best,
+        "median_s": statistics.median(times),
+        "mb_per_s": total_bytes / best / 1e6 if best else None,
+        "files_per_s": len(inputs) / best if best else None,
+        "peak_memory_bytes": peak,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@click.command(options_metavar="[options]")
+@click.option("--output", "-o", type=click.Path(), default=None, help="Write the JSON report to this file.")
+@click.option("--compare", "-c", type=click.Path(exists=True), default=None, help="Compare the results with a previous JSON report.")
+@click.option("--filter", "-k", "filter_", default="", help="Only run the cases whose name contains this text.")
+@click.option("--repeat", "-r", default=5, help="Number of timed runs per case (the best one is used).")
+@click.option("--seed", default=0, help="Seed for the synthetic corpus.")
+@click.option("--scale", default=1, help="Multiplies the amount of files in the corpus.")
+def cli(output = None, compare = None, filter_ = "", repeat = 5, seed = 0, scale = 1):
+    """
+    Benchmarks Flora's format codecs on a deterministic synthetic corpus.
+    """
+    data = corpus.generate(seed, scale)
+    previous = {}
+    if compare is not None:
+        previous = json.load(open(compare, encoding="utf-8"))["results"]
+
+    results = {}
+    for name, inputs, fn, size in cases(data):
+        if filter_ not in name:
+            continue
+        try:
+            results[name] = measure(inputs, fn, size, repeat)
+        except NotImplementedError as e:
+            print(f"{name:<18} unsupported ({e})")
+            continue
+        r = results[name]
+        line = f"{name:<18} {r['mb_per_s']:9.2f} MB/s {r['files_per_s']:10.1f} files/s {r['peak_memory_bytes'] / 1e6:9.2f} MB peak"
+        if name in previous:
+            line += f"   x{previous[name]['best_s'] / r['best_s']:.2f} vs. previous"
+        print(line)
+
+    report = {
+        "flora_version": v,
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "scale": scale,
+        "repeat": repeat,
+        "results": results,
+    }
+    if output is not None:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,133 @@
+'''Checks that Flora's LZ10 and LZ11 decoders give exactly the same output as reference decoders, on a large generated corpus'''
+import click
+import random
+
+from ndspy import lz10 as ndspy_lz10
+
+from bench import corpus
+from formats.compression import lz10, lz11
+
+def reference_lz11(data):
+    """
+    Straightforward byte-by-byte LZ11 decoder, to check the fast one against.
+    """
+    size, pos = int.from_bytes(data[1:4], "little"), 4
+    if size == 0:
+        size, pos = int.from_bytes(data[4:8], "little"), 8
+    out = bytearray()
+    while len(out) < size:
+        flags = data[pos]; pos += 1
+        for bit in range(8):
+            if len(out) >= size:
+                break
+            if not flags & 0x80 >> bit:
+                out.append(data[pos]); pos += 1
+                continue
+            indicator = data[pos] >> 4
+            if indicator == 0:
+                length = ((data[pos] & 0xF) << 4 | data[pos+1] >> 4) + 0x11
+                disp = ((data[pos+1] & 0xF) << 8 | data[pos+2]) + 1
+                pos += 3
+            elif indicator == 1:
+                length = ((data[pos] & 0xF) << 12 | data[pos+1] << 4 | data[pos+2] >> 4) + 0x111
+                disp = ((data[pos+2] & 0xF) << 8 | data[pos+3]) + 1
+                pos += 4
+            else:
+                length = indicator + 1
+                disp = ((data[pos] & 0xF) << 8 | data[pos+1]) + 1
+                pos += 2
+            for _ in range(length):
+                if len(out) >= size:
+                    break
+                out.append(out[-disp])
+    return bytes(out)
+
+def random_lz10(rng, size):
+    """
+    A random (but valid) LZ10 stream, with lots of short back-references that overlap the data being written.
+    """
+    out = bytearray((0x10 | size << 8).to_bytes(4, "little"))
+    written = 0
+    while written < size:
+        flags_pos = len(out)
+        out.append(0)
+        for bit in range(8):
+            if written >= size:
+                break
+            if written > 0 and rng.random() < 0.6:
+                out[flags_pos] |= 0x80 >> bit
+                disp = rng.randint(1, min(written, 0x1000))
+                length = rng.randint(3, 18)
+                out += bytes(((length - 3) << 4 | (disp - 1) >> 8, (disp - 1) & 0xFF))
+                written += length
+            else:
+                out.append(rng.randrange(256))
+                written += 1
+    return bytes(out)
+
+def samples(rng, count):
+    """
+    Uncompressed test data: the benchmark corpus, plus random data with every kind of repetition.
+    """
+    data = corpus.generate(rng.randrange(1 << 30))
+    out = [img.tobytes() for img in data["bg"]]
+    out += [b"".join(files) for files, _ in data["pcm"]]
+    out += data["rle"]
+    out += [b"", b"\x00", b"ab" * 3000, bytes(70000)]
+    for _ in range(count):
+        size = rng.choice([1, 2, 3, 7, 8, 9, 100, 4096, 5000, 20000])
+        kind = rng.randrange(4)
+        if kind == 0:
+            out.append(bytes(rng.randrange(256) for _ in range(size)))
+        elif kind == 1:
+            pattern = bytes(rng.randrange(256) for _ in range(rng.randint(1, 40)))
+            out.append((pattern * (size // len(pattern) + 1))[:size])
+        elif kind == 2:
+            out.append(corpus.text(rng, size))
+        else:
+            out.append(bytes(rng.choice(b"\x00\x00\x00\x01\xff") for _ in range(size)))
+    return out
+
+@click.command(options_metavar="[options]")
+@click.option("--seed", default=0, help="Seed for the generated corpus.")
+@click.option("--count", "-n", default=300, help="Number of random samples, on top of the benchmark corpus.")
+def cli(seed = 0, count = 300):
+    """
+    Compresses a generated corpus with ndspy's LZ10 compressor (and a simple LZ11 one), and checks that Flora's decoders
+    give back exactly the same bytes as ndspy's LZ10 decoder and a reference LZ11 decoder. Also checks random LZ10 streams.
+    """
+    rng = random.Random(seed)
+    failures = 0
+    checked = 0
+    def check(name, expected, compressed, decoder):
+        nonlocal failures, checked
+        checked += 1
+        try:
+            result = decoder.decompress(compressed)
+            into = bytearray(len(expected) + 16)
+            written = decoder.decompress_into(compressed, into)
+            ok = result == expected and bytes(into[:written]) == expected
+        except Exception as e:
+            print(f"{name}: error ({e!r})")
+            ok = False
+        if not ok:
+            failures += 1
+            print(f"{name}: output differs ({len(expected)} bytes)")
+
+    for i, data in enumerate(samples(rng, count)):
+        check(f"lz10 sample {i}", data, ndspy_lz10.compress(data), lz10)
+        compressed = corpus.lz11_compress(data)
+        check(f"lz11 sample {i}", reference_lz11(compressed), compressed, lz11)
+        if reference_lz11(compressed) != data:
+            failures += 1
+            print(f"lz11 sample {i}: the test compressor is broken")
+    for i in range(count):
+        stream = random_lz10(rng, rng.choice([10, 1000, 30000]))
+        check(f"lz10 stream {i}", ndspy_lz10.decompress(stream), stream, lz10)
+
+    print(f"{checked} checked, {failures} failed.")
+    if failures:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    cli()
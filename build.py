@@ -0,0 +1,274 @@
+import click
+import concurrent.futures
+import hashlib
+import json
+import os
+import time
+
+STATE_FILE = ".flora-build.json"
+
+class Target:
+    """
+    A single output of the project manifest, along with the files it's built from.
+
+    Supported types are:
+    - "gds": a GDS script, from a JSON file made by `gds extract` (input)
+    - "bg": a BG ARC file, from a PNG (input). Optional keys: "colors", "tile_aware" (see `bg create`)
+    - "pcm": a PCM file, from the files directly inside a directory (input). If "base" is given, that PCM is used,
+      replacing the files inside it with the ones in the directory (like `pcm replace`); otherwise a new PCM is made (like `pcm create`)
+    """
+    def __init__(self, info, root):
+        self.info = info
+        self.type = info["type"]
+        if self.type not in ("gds", "bg", "pcm"):
+            raise Exception(f"Build error: Invalid or unsupported target type '{self.type}'!")
+        self.input = os.path.normpath(os.path.join(root, info["input"]))
+        self.output = os.path.normpath(os.path.join(root, info["output"]))
+        self.base = os.path.normpath(os.path.join(root, info["base"])) if "base" in info else None
+        self.deps = set() # targets that have to be built before this one
+
+    def inputs(self, outputs):
+        """
+        All the files this target is built from. `outputs` are the outputs of every target,
+        since those might not exist yet but still be inputs (e.g. a GDS script built into a PCM's directory).
+        """
+        if self.type != "pcm":
+            return [self.input]
+        files = set()
+        if os.path.isdir(self.input):
+            files.update(e.path for e in os.scandir(self.input) if e.is_file())
+        files.update(o for o in outputs if os.path.dirname(o) == self.input)
+        if self.base is not None:
+            files.add(self.base)
+        return sorted(files)
+
+def load_manifest(path):
+    root = os.path.dirname(os.path.abspath(path))
+    manifest = json.load(open(path, encoding="utf-8"))
+    targets = [Target(info, root) for info in manifest["targets"]]
+
+    by_output = {}
+    for target in targets:
+        if target.output in by_output:
+            raise Exception(f"Build error: more than one target builds {target.output}!")
+        by_output[target.output] = target
+    for target in targets:
+        for i in target.inputs(by_output):
+            if i in by_output:
+                target.deps.add(by_output[i])
+
+    # Make sure there are no cycles, so that the build can't get stuck
+    done = set()
+    def visit(target, path):
+        if target in path:
+            raise Exception(f"Build error: circular dependency involving {target.output}!")
+        if target in done:
+            return
+        for dep in target.deps:
+            visit(dep, path | {target})
+        done.add(target)
+    for target in targets:
+        visit(target, frozenset())
+
+    return root, targets
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class State:
+    """
+    What every target was last built from: the mtime, size and hash of its inputs, and the mtime and size of its output.
+    Hashes are only recalculated when the mtime or size of a file changes. Paths are stored relative to the project's root.
+    """
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        self.targets = {}
+        if os.path.exists(path):
+            self.targets = json.load(open(path, encoding="utf-8"))
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.targets, f, indent=4)
+
+    def key(self, path):
+        return os.path.relpath(path, self.root).replace("\\", "/")
+
+    def fingerprint(self, path, previous = None):
+        stat = os.stat(path)
+        if previous is not None and previous[:2] == [stat.st_mtime_ns, stat.st_size]:
+            return previous
+        return [stat.st_mtime_ns, stat.st_size, file_hash(path)]
+
+    def is_up_to_date(self, target, inputs):
+        state = self.targets.get(self.key(target.output))
+        if state is None or state["config"] != target.info or not os.path.exists(target.output):
+            return False
+        stat = os.stat(target.output)
+        if state["output"] != [stat.st_mtime_ns, stat.st_size] or sorted(state["inputs"]) != sorted(self.key(i) for i in inputs):
+            return False
+        for i in inputs:
+            previous = state["inputs"][self.key(i)]
+            current = self.fingerprint(i, previous)
+            if current[2] != previous[2]:
+                return False
+            state["inputs"][self.key(i)] = current # so that a touched but unchanged file doesn't get rehashed every time
+        return True
+
+    def record(self, target, inputs):
+        previous = self.targets.get(self.key(target.output), {}).get("inputs", {})
+        stat = os.stat(target.output)
+        self.targets[self.key(target.output)] = {
+            "config": target.info,
+            "inputs": {self.key(i): self.fingerprint(i, previous.get(self.key(i))) for i in inputs},
+            "output": [stat.st_mtime_ns, stat.st_size],
+        }
+
+def build_target(target):
+    """
+    Builds a single target. Runs in a worker process.
+    """
+    from formats import bg, compression, pcm as pcm_format
+    from formats.gds import GDS
+    from formats.pcm import PCM
+
+    if target.type == "gds":
+        out = GDS(open(target.input, encoding="utf-8").read(), "json").to_bin()
+    elif target.type == "bg":
+        from PIL import Image
+        out = bg.from_image(Image.open(target.input), target.info.get("colors", 256), target.info.get("tile_aware", 0))
+    elif target.type == "pcm":
+        names = sorted(e.name for e in os.scandir(target.input) if e.is_file())
+        paths = [os.path.join(target.input, name) for name in names]
+        if target.base is None:
+            out = compression.compress(pcm_format.pack(paths, names))
+        else:
+            pcm = PCM(pcm_format.load(open(target.base, "rb").read()))
+            pcm.replace_many({name: open(path, "rb").read() for name, path in zip(names, paths)})
+            out = compression.compress(pcm.file)
+
+    os.makedirs(os.path.dirname(target.output) or ".", exist_ok=True)
+    # Write to a temporary file first, so that an interrupted build never leaves a half-written output
+    with open(target.output + ".tmp", "wb") as f:
+        f.write(out)
+    os.replace(target.output + ".tmp", target.output)
+
+def build(manifest, jobs = None, force = False):
+    """
+    Builds every target of the manifest that isn't up to date, running independent targets in parallel.
+    Returns the number of targets that failed.
+    """
+    root, targets = load_manifest(manifest)
+    state = State(os.path.join(root, STATE_FILE), root)
+    outputs = {t.output for t in targets}
+
+    pending = set(targets)
+    running = {} # future -> (target, inputs)
+    done = set()
+    failed = set()
+    built = 0
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        while pending or running:
+            for target in sorted(pending, key=lambda t: t.output):
+                if not target.deps <= done | failed:
+                    continue
+                pending.remove(target)
+                if target.deps & failed:
+                    print(f"Skipping {os.path.relpath(target.output, root)} (a dependency failed)")
+                    failed.add(target)
+                    continue
+                inputs = target.inputs(outputs)
+                missing = [i for i in inputs if not os.path.exists(i)]
+                if missing:
+                    print(f"Error building {os.path.relpath(target.output, root)}: {missing[0]} doesn't exist")
+                    failed.add(target)
+                    continue
+                if not force and state.is_up_to_date(target, inputs):
+                    done.add(target)
+                    continue
+                print(f"Building {os.path.relpath(target.output, root)}")
+                running[pool.submit(build_target, target)] = (target, inputs)
+
+            if not running:
+                continue
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                target, inputs = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error building {os.path.relpath(target.output, root)}: {e}")
+                    failed.add(target)
+                    continue
+                state.record(target, inputs)
+                done.add(target)
+                built += 1
+            state.save()
+
+    state.save()
+    print(f"{built} built, {len(done) - built} up to date, {len(failed)} failed.")
+    return len(failed)
+
+def watched_files(manifest):
+    root, targets = load_manifest(manifest)
+    outputs = {t.output for t in targets}
+    files = {manifest}
+    for target in targets:
+        files.update(i for i in target.inputs(outputs) if i not in outputs)
+    stats = {}
+    for f in files:
+        try:
+            stat = os.stat(f)
+            stats[f] = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stats[f] = None
+    return stats
+
+@click.command(
+                name = "build",
+                options_metavar = "[options]"
+            )
+@click.argument("manifest", required=False, default="flora.json", type=click.Path(exists=True, dir_okay=False))
+@click.option("--jobs", "-j", type=int, default=None, help="Number of targets built at the same time. Defaults to the number of CPUs.")
+@click.option("--force", "-f", is_flag=True, help="Rebuild every target, even if it's up to date.")
+@click.option("--watch", "-w", is_flag=True, help="Keep running, and rebuild the affected targets whenever an input changes.")
+@click.option("--interval", default=1.0, help="How often (in seconds) to check for changes with --watch.")
+def cli(manifest = "flora.json", jobs = None, force = False, watch = False, interval = 1.0):
+    """
+    Builds a mod project from its manifest (flora.json by default).
+
+    The manifest is a JSON file with a list of "targets", each one with a "type" ("gds", "bg" or "pcm"), an "input" and an "output"
+    (paths relative to the manifest). For example: {"type": "bg", "input": "art/q1_bg.png", "output": "out/bg/q1_bg.arc"}.
+    "pcm" targets take a directory as input, and can take a "base" PCM whose files will be replaced (like `pcm replace`).
+
+    Targets are only rebuilt when their inputs change (by hash), or when a target they depend on (one whose output is one of their inputs) was rebuilt.
+    Independent targets are built in parallel.
+    """
+    failed = build(manifest, jobs, force)
+    if not watch:
+        if failed:
+            raise SystemExit(1)
+        return
+
+    print("Watching for changes... (Ctrl+C to stop)")
+    try:
+        last = watched_files(manifest)
+        while True:
+            time.sleep(interval)
+            try:
+                current = watched_files(manifest)
+            except Exception as e:
+                print(f"Error reading manifest: {e}")
+                continue
+            if current != last:
+                last = current
+                try:
+                    build(manifest, jobs)
+                except Exception as e:
+                    print(f"Error: {e}")
+    except KeyboardInterrupt:
+        pass
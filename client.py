@@ -0,0 +1,49 @@
+'''Thin client for `flora serve`'''
+import json
+import os
+import socket
+import sys
+import tempfile
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), "flora.sock")
+
+def request(method, params = None, *, path = None):
+    """
+    Sends a single JSON-RPC request to a running `flora serve --socket` server and returns its result.
+
+    If `path` is unset, the FLORA_SOCKET environment variable is used, or otherwise the default socket path.
+    """
+    if path is None:
+        path = os.environ.get("FLORA_SOCKET", DEFAULT_SOCKET)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall(json.dumps({"jsonrpc": "2.0", "id": 0, "method": method, "params": params or {}}).encode("utf-8") + b"\n")
+        response = b""
+        while not response.endswith(b"\n"):
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            response += chunk
+    response = json.loads(response)
+    if "error" in response:
+        raise Exception(response["error"]["message"])
+    return response["result"]
+
+def main(argv = None):
+    """
+    Runs a Flora command on the server, with the same arguments, output and exit code as `python main.py ...` would have.
+    (e.g. `python client.py gds create script.json script.gds`)
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    try:
+        result = request("run", {"args": argv, "cwd": os.getcwd()})
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("Error: no Flora server is running. Start one with `python main.py serve --socket`.", file=sys.stderr)
+        sys.exit(1)
+    sys.stdout.write(result["stdout"])
+    sys.stderr.write(result["stderr"])
+    sys.exit(result["exit_code"])
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,9 @@
-from formats import gds, bg, pcm, puzzle, ndsrom, compression
+import importlib
+
+__all__ = ["gds", "bg", "pcm", "puzzle", "ndsrom", "compression"]
+
+def __getattr__(name):
+    # Submodules are imported on first access, so that importing `formats` by itself stays cheap
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
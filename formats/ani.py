@@ -0,0 +1,339 @@
+import click
+import concurrent.futures
+import json
+import os
+
+from PIL import Image
+
+from . import compression, palette, quantize, tiles
+from timings import span
+from version import v
+
+@click.group(help="Animated sprite format.",options_metavar='')
+def cli():
+    pass
+
+# Color format IDs used in the file
+FORMAT_4BPP = 3
+FORMAT_8BPP = 4
+
+class ANI:
+    """
+    An ANI sprite file: a set of images (each one made of several rectangular parts), a shared palette, and the animations that use them.
+
+    Only the position of each image's data is read when loading, and images are decoded on demand with `image()`.
+    """
+    def __init__(self, file):
+        self.header = file[:4]
+        try:
+            data = compression.decompress(file[4:])
+        except TypeError:
+            raise TypeError("Input file is not a valid archive file with a known compression type")
+        with span("ani.parse", len(data)):
+            self.parse(data)
+
+    def parse(self, data):
+        self.data = data
+        num_images = int.from_bytes(data[0:2], "little")
+        self.color_format = int.from_bytes(data[2:4], "little")
+        if self.color_format not in (FORMAT_4BPP, FORMAT_8BPP):
+            raise Exception(f"ANI file error: Invalid or unsupported color format {self.color_format}!")
+        bpp = 4 if self.color_format == FORMAT_4BPP else 8
+
+        c = 4
+        self.images = []
+        for _ in range(num_images):
+            image = {
+                "width": int.from_bytes(data[c:c+2], "little"),
+                "height": int.from_bytes(data[c+2:c+4], "little"),
+                "unknown": int.from_bytes(data[c+6:c+8], "little"),
+                "parts": []
+            }
+            num_parts = int.from_bytes(data[c+4:c+6], "little")
+            c += 8
+            for _ in range(num_parts):
+                part = {
+                    "x": int.from_bytes(data[c:c+2], "little"),
+                    "y": int.from_bytes(data[c+2:c+4], "little"),
+                    "width": 8 << int.from_bytes(data[c+4:c+6], "little"),
+                    "height": 8 << int.from_bytes(data[c+6:c+8], "little"),
+                    "offset": c+8
+                }
+                c += 8 + part["width"] * part["height"] * bpp // 8
+                image["parts"].append(part)
+            self.images.append(image)
+
+        num_colors = int.from_bytes(data[c:c+4], "little")
+        self.palette = data[c+4:c+4+num_colors*2]
+        c += 4 + num_colors*2
+
+        self.anim_data = data[c:]
+        self.anims = parse_anims(self.anim_data)
+
+    def __len__(self):
+        return len(self.images)
+
+    def image(self, index, full_range = False):
+        """
+        Decodes a single image into an indexed (mode "P") PIL image.
+        See `palette.decode` for the meaning of `full_range`.
+        """
+        image = self.images[index]
+        with span("ani.decode", image["width"] * image["height"]):
+            out = Image.frombytes("P", (image["width"], image["height"]), self.pixels(index))
+            out.putpalette(palette.decode(self.palette, full_range))
+        return out
+
+    def pixels(self, index):
+        """
+        Decodes a single image into linear pixel data, one byte per pixel.
+        """
+        image = self.images[index]
+        width, height = image["width"], image["height"]
+        out = Image.new("P", (width, height))
+        for part in image["parts"]:
+            size = part["width"] * part["height"]
+            if self.color_format == FORMAT_4BPP:
+                data = tiles.unpack_4bpp(self.data[part["offset"]:part["offset"] + size // 2])
+            else:
+                data = self.data[part["offset"]:part["offset"] + size]
+            data = tiles.untile(data, part["width"], part["height"])
+            out.paste(Image.frombytes("P", (part["width"], part["height"]), data), (part["x"], part["y"]))
+        return out.tobytes()
+
+    def to_json(self):
+        """
+        Everything except the pixel data of the images, as JSON. The images themselves are referred to by file name.
+        """
+        out = {
+            "version": v,
+            "header": int.from_bytes(self.header, "little"),
+            "bpp": 4 if self.color_format == FORMAT_4BPP else 8,
+            "images": [
+                {"file": f"{i}.png", "width": img["width"], "height": img["height"], "unknown": img["unknown"]}
+                for i, img in enumerate(self.images)
+            ]
+        }
+        if self.anims is not None:
+            out["animations"] = self.anims
+        else:
+            out["animation_data"] = self.anim_data.hex()
+        return json.dumps(out, indent=4)
+
+def parse_anims(data):
+    """
+    Reads the animation data at the end of an ANI file: the number of animations, their 30-byte names, and then, for every animation,
+    the number of frames followed by the index, duration and image of every frame.
+
+    Returns None if the data doesn't match that layout, so that it can be kept as-is.
+    """
+    try:
+        num_anims = int.from_bytes(data[0:4], "little")
+        c = 4 + num_anims * 30
+        if c > len(data):
+            return None
+        anims = []
+        for i in range(num_anims):
+            name = data[4 + i*30:4 + (i+1)*30]
+            num_frames = int.from_bytes(data[c:c+4], "little")
+            c += 4
+            if c + num_frames * 12 > len(data):
+                return None
+            values = [int.from_bytes(data[c + j*4:c + j*4 + 4], "little") for j in range(num_frames * 3)]
+            c += num_frames * 12
+            anims.append({
+                "name": name.split(b"\x00")[0].decode("ascii"),
+                "frames": [
+                    {"index": values[j], "duration": values[num_frames + j], "image": values[2*num_frames + j]}
+                    for j in range(num_frames)
+                ]
+            })
+    except UnicodeDecodeError:
+        return None
+    if write_anims(anims) != bytes(data):
+        return None
+    return anims
+
+def write_anims(anims):
+    out = len(anims).to_bytes(4, "little")
+    for anim in anims:
+        name = anim["name"].encode("ascii")
+        if len(name) > 30:
+            raise Exception("Animation names longer than 30 characters are not supported.")
+        out += name + b"\x00" * (30 - len(name))
+    for anim in anims:
+        frames = anim["frames"]
+        out += len(frames).to_bytes(4, "little")
+        for key in ("index", "duration", "image"):
+            for frame in frames:
+                out += frame[key].to_bytes(4, "little")
+    return out
+
+def _split(size):
+    # Part sizes are powers of 2 from 8 to 64
+    out = []
+    while size > 0:
+        part = 64
+        while part > 8 and part > size:
+            part //= 2
+        out.append(part)
+        size -= part
+    return out
+
+def from_images(images, info):
+    """
+    Creates the contents of an ANI file from a list of PIL images and the JSON info given by `ANI.to_json()` (already parsed).
+
+    If all images are indexed and share the first image's palette, that palette is used as-is. Otherwise, all images are quantized together.
+    """
+    bpp = info.get("bpp", 8)
+    num_colors = 16 if bpp == 4 else 256
+    pal = images[0].getpalette() if images[0].mode == "P" else None
+    if pal is None or any(img.mode != "P" or img.getpalette() != pal for img in images):
+        # Quantize all the images at once (stacked vertically), so that they get the same palette
+        sheet = Image.new("RGB", (max(img.width for img in images), sum(img.height for img in images)))
+        y = 0
+        for img in images:
+            sheet.paste(img.convert("RGB"), (0, y))
+            y += img.height
+        sheet = quantize.quantize(sheet, num_colors)
+        pal = sheet.getpalette()
+        y = 0
+        for i, img in enumerate(images):
+            images[i] = sheet.crop((0, y, img.width, y + img.height))
+            y += img.height
+
+    with span("ani.encode") as s:
+        out = bytearray()
+        out += len(images).to_bytes(2, "little")
+        out += (FORMAT_4BPP if bpp == 4 else FORMAT_8BPP).to_bytes(2, "little")
+        for img, img_info in zip(images, info["images"]):
+            width, height = img.size
+            parts = []
+            y = 0
+            for part_h in _split(height):
+                x = 0
+                for part_w in _split(width):
+                    part = img.crop((x, y, x + part_w, y + part_h)).tobytes()
+                    # Fully transparent parts don't need to be stored
+                    if part.strip(b"\x00") != b"":
+                        parts.append((x, y, part_w, part_h, tiles.tile(part, part_w, part_h)))
+                    x += part_w
+                y += part_h
+
+            out += width.to_bytes(2, "little")
+            out += height.to_bytes(2, "little")
+            out += len(parts).to_bytes(2, "little")
+            out += img_info.get("unknown", 0).to_bytes(2, "little")
+            for x, y, part_w, part_h, data in parts:
+                out += x.to_bytes(2, "little")
+                out += y.to_bytes(2, "little")
+                out += (part_w.bit_length() - 4).to_bytes(2, "little")
+                out += (part_h.bit_length() - 4).to_bytes(2, "little")
+                if bpp == 4:
+                    if max(data) >= 16:
+                        raise Exception("4bpp images can't use more than 16 colors!")
+                    data = tiles.pack_4bpp(data)
+                out += data
+
+        pal = palette.encode(pal)
+        if len(pal) > num_colors*2:
+            raise Exception(f"Palette can't have more than {num_colors} colors!")
+        out += (len(pal)//2).to_bytes(4, "little")
+        out += pal
+
+        if "animations" in info:
+            out += write_anims(info["animations"])
+        else:
+            out += bytes.fromhex(info.get("animation_data", ""))
+        s.add(len(out))
+
+    return info.get("header", 2).to_bytes(4, "little") + compression.compress(bytes(out))
+
+# Every worker loads the ANI file once, and then decodes the images it's given
+_worker_ani = None
+
+def _init_worker(input, full_range):
+    global _worker_ani
+    _worker_ani = (ANI(open(input, "rb").read()), full_range)
+
+def _save_image(index, path):
+    ani, full_range = _worker_ani
+    img = ani.image(index, full_range)
+    with span("png.encode", img.size[0] * img.size[1]):
+        img.save(path)
+
+def _decode_image(index):
+    ani, _ = _worker_ani
+    return ani.pixels(index)
+
+@cli.command(
+                name = "extract",
+                help = "Converts an ANI file into PNGs (one per image, or a single sprite sheet) and a JSON file with the animation data.",
+                no_args_is_help = True,
+                options_metavar = "[options]"
+            )
+@click.argument("input")
+@click.argument("output")
+@click.option("--sheet", "-s", is_flag=True, help="Put all the images in a single sprite sheet (sheet.png), one per row, instead of one PNG per image.")
+@click.option("--jobs", "-j", type=int, default=None, help="Number of worker processes used to decode the images. Defaults to the number of CPUs.")
+@click.option("--full-range", is_flag=True, help="Expand the colors to the full 0-255 range, instead of multiplying them by 8.")
+def extract(input, output, sheet = False, jobs = None, full_range = False):
+    ani = ANI(open(input, "rb").read())
+    try:
+        os.mkdir(output)
+    except FileExistsError:
+        pass
+
+    info = json.loads(ani.to_json())
+    if sheet:
+        for i, img in enumerate(info["images"]):
+            img["file"] = "sheet.png"
+            img["y"] = sum(other["height"] for other in ani.images[:i])
+    with open(f"{output}/ani.json", "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=4)
+
+    if len(ani) == 0:
+        return
+
+    # Images are decoded by the workers and written (or pasted into the sheet) as soon as they're ready, so they don't all stay in memory
+    with concurrent.futures.ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(input, full_range)) as pool:
+        if sheet:
+            out = Image.new("P", (max(img["width"] for img in ani.images), sum(img["height"] for img in ani.images)))
+            out.putpalette(palette.decode(ani.palette, full_range))
+            y = 0
+            for img, pixels in zip(ani.images, pool.map(_decode_image, range(len(ani)))):
+                out.paste(Image.frombytes("P", (img["width"], img["height"]), pixels), (0, y))
+                y += img["height"]
+            with span("png.encode", out.size[0] * out.size[1]):
+                out.save(f"{output}/sheet.png")
+        else:
+            paths = [f"{output}/{img['file']}" for img in info["images"]]
+            for _ in pool.map(_save_image, range(len(ani)), paths):
+                pass
+
+@cli.command(
+                name = "create",
+                help = "Creates an ANI file from a directory made by `ani extract`.",
+                no_args_is_help = True
+            )
+@click.argument("input")
+@click.argument("output")
+def create(input, output):
+    info = json.load(open(f"{input}/ani.json", encoding="utf-8"))
+    opened = {}
+    images = []
+    for img in info["images"]:
+        if img["file"] not in opened:
+            opened[img["file"]] = Image.open(f"{input}/{img['file']}")
+        src = opened[img["file"]]
+        y = img.get("y", 0)
+        crop = src.crop((0, y, img["width"], y + img["height"]))
+        if src.mode == "P":
+            crop.putpalette(src.getpalette())
+        images.append(crop)
+
+    out = from_images(images, info)
+    output = open(output, "wb")
+    output.write(out)
+    output.close()
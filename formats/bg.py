@@ -1,191 +1,131 @@
 import click
-from ndspy import lz10
+import concurrent.futures
+import json
+import math
+import os
 from PIL import Image
-from .compression import huffman, rle
+from . import compression, palette, quantize, rawimage, tiles as tiling
+from timings import span
 
 @click.group(help="'Background' / texture format.",options_metavar='')
 def cli():
     pass
 
-@cli.command(
-                name = "extract",
-                help="Converts a texture ARC file into a PNG.",
-                no_args_is_help = True
-            )
-@click.argument("input")
-@click.argument("output", required=False)
-def extract(input, output=None):
-    if output is None:
-        output = input + ".png"
-    
-    input = open(input, "rb").read()
-
-    data = None
-
+def _decompress(arc):
     try:
-        data = lz10.decompress(input[4:])
+        return compression.decompress(arc[4:])
     except TypeError:
-        # Not LZ10, try next format
-        pass
-    
-    try:
-        data = huffman.decompress(input[4:])
-    except TypeError:
-        # Not Huffman, try next format
-        pass
-    
-    try:
-        data = rle.decompress(input[4:])
-    except TypeError:
-        # Not RLE, try next format
-        pass
-    
-    if data is None:
-        raise TypeError(f"Input file {input} is not a valid archive file with a known compression type")
+        raise TypeError("Input file is not a valid archive file with a known compression type")
+
+def to_image(arc, full_range = False, rect = None):
+    """
+    Decodes the contents of a texture ARC file into an indexed (mode "P") PIL image.
+    See `palette.decode` for the meaning of `full_range`.
 
+    `rect` is an optional (x, y, width, height) rectangle, in tiles: if given, only that part of the image is decoded.
+    """
+    data = _decompress(arc)
+    with span("bg.decode", len(data)):
+        return _to_image(data, full_range, rect)
+
+def _parse(data):
+    # Returns the palette (BGR555), the tiles, the size of the image in tiles, and the tile map
     p_len = int.from_bytes(data[0:4], "little")
-    c = 0
-    p_colors = []
-    while c < p_len*2:
-        inf = int.from_bytes(data[c+4:c+6], "little")
-        b = (inf>>10 & 0x1f) * 8
-        g = (inf>>5 & 0x1f) * 8
-        r = (inf & 0x1f) * 8
-        p_colors.append([r, g, b])
-        c += 2
-
-    data = data[4+c:]
+    pal = data[4:4+p_len*2]
+
+    data = data[4+p_len*2:]
     num_tiles = int.from_bytes(data[:4], "little")
-    tiles = []
-    for tile in range(num_tiles):
-        curr_tile = []
-        for row in range(8):
-            curr_row = []
-            pos = 4+tile*0x40+row*8
-            for pixel in data[pos:pos+8]:
-                curr_row.append(pixel)
-            curr_tile.append(curr_row)
-        tiles.append(curr_tile)
+    tiles = [data[4+tile*0x40:4+(tile+1)*0x40] for tile in range(num_tiles)]
 
     data = data[4+0x40*num_tiles:]
     width = int.from_bytes(data[:2], "little")
     height = int.from_bytes(data[2:4], "little")
-    c = 0
-    map = []
-    while True:
-        if c >= width * height:
-            break
-        tile = int.from_bytes(data[4+c*2:6+c*2], "little")
-        flip_x = bool(tile>>11 & 1)
-        flip_y = bool(tile>>10 & 1)
-        tile_num = tile & 0x3ff
-        map.append((tile_num, flip_x, flip_y))
-        c += 1
-    
-    c = 0
-    out = []
-    rows = [[],[],[],[],[],[],[],[]]
-    for t in map:
-        tile = list(tiles[t[0]])
-        if t[2]:
-            tile.reverse() #Flip Y
-        if t[1]:
-            ntile = []
-            for row in tile:
-                row = list(row) #so it doesn't override the OG rows
-                row.reverse() #Flip X
-                ntile.append(row)
-            tile = ntile
-
-        d = 0
-        for row in rows:
-            rows[d] += tile[d]
-            d += 1
-        
-        c += 1
-
-        if c % width == 0:
-            for row in rows:
-                out += row
-            rows = [[],[],[],[],[],[],[],[]]
-    p = []
-    for h in p_colors:
-        p += h
-    out = bytes(out)
-    img = Image.frombytes("P",(width*8, height*8),out)
-    img.putpalette(p)
-    img.save(output)
+    if p_len > 256 or len(data) < 4 + width*height*2:
+        raise Exception("BG file error: Not a valid texture file!")
+    return pal, tiles, width, height, data[4:4+width*height*2]
 
-@cli.command(
-                name = "create",
-                help = "Makes a texture ARC file from a PNG",
-                no_args_is_help = True
-            )
-@click.argument("input")
-@click.argument("output", required=False)
-def create(input, output=None):
-    if output is None:
-        output = input
-        if output.lower().endswith(".png"):
-            output = output[:-4]
-        if not output.lower().endswith(".arc"):
-            output = output + ".arc"
-    
-    img = Image.open(input)
-    output = open(output, "wb")
-    width, height = img.size
+def _to_image(data, full_range, rect = None):
+    pal, tiles, width, height, tile_map = _parse(data)
+    x0, y0, w, h = rect if rect is not None else (0, 0, width, height)
+    if x0 < 0 or y0 < 0 or w <= 0 or h <= 0 or x0 + w > width or y0 + h > height:
+        raise Exception(f"Tile rectangle {(x0, y0, w, h)} is outside of the image ({width}x{height} tiles)!")
 
-    out = b''
+    out = bytearray(w * h * 0x40)
+    for y in range(h):
+        for x in range(w):
+            c = (y0 + y) * width + x0 + x
+            tile = int.from_bytes(tile_map[c*2:c*2+2], "little")
+            flip_x = bool(tile>>11 & 1)
+            flip_y = bool(tile>>10 & 1)
+            tile_num = tile & 0x3ff
+            tiling.put_tile(out, w*8, x, y, tiles[tile_num], flip_x, flip_y)
+
+    img = Image.frombytes("P",(w*8, h*8),bytes(out))
+    img.putpalette(palette.decode(pal, full_range))
+    return img
+
+def thumbnail(arc, full_range = False):
+    """
+    Decodes a texture ARC file into a 1/8 scale RGB PIL image, where every pixel is the average color of a tile.
+    Only the average of every unique tile is calculated, and the full image is never built, so it's much faster than `to_image`.
+    """
+    data = _decompress(arc)
+    with span("bg.thumbnail", len(data)):
+        pal, tiles, width, height, tile_map = _parse(data)
+        rgb = palette.decode(pal, full_range)
+        rgb += bytes(768 - len(rgb))
+        # The average of every channel of a tile is the sum of its pixels' values (each pixel translated into that channel) / 64
+        channels = [rgb[i::3] for i in range(3)]
+        averages = [bytes((sum(tile.translate(channel)) + 32) // 64 for channel in channels) for tile in tiles]
 
+        out = bytearray(width * height * 3)
+        for c in range(width * height):
+            out[c*3:c*3+3] = averages[int.from_bytes(tile_map[c*2:c*2+2], "little") & 0x3ff]
+        return Image.frombytes("RGB", (width, height), bytes(out))
+
+def from_image(img, num_colors = 256, tile_aware = 0):
+    """
+    Encodes a PIL image into the contents of a texture ARC file.
+
+    Images that aren't indexed (mode "P") are quantized to `num_colors` colors first.
+    If `tile_aware` is set, tiles that look almost the same are merged to lower the number of unique tiles; higher values merge more tiles
+    (it's the `shift` of `quantize.merge_similar_tiles`).
+    """
     if img.mode != "P":
-        raise Exception("The image needs a palette!")
-
-    palette = list(img.palette.getdata()[1])
-    pal = []
-    color = []
-    for c in range(len(palette)):
-        col = palette[c] // 8
-        if c % 3 == 2:
-            pal.append(color+[col])
-            color = []
-        else:
-            color.append(col)
+        with span("bg.quantize", img.size[0] * img.size[1]):
+            img = quantize.quantize(img, num_colors)
+    if tile_aware:
+        with span("bg.merge_tiles", img.size[0] * img.size[1]):
+            img = quantize.merge_similar_tiles(img, tile_aware)
+
+    with span("bg.encode", img.size[0] * img.size[1]):
+        out = _from_image(img)
+    # TODO: use ideal compression method, or let user override
+    return b"\x02\x00\x00\x00" + compression.compress(out)
 
-    if len(pal) > 256:
+def _from_image(img):
+    width, height = img.size
+
+    out = b''
+
+    pal = palette.encode(img.getpalette())
+    if len(pal) > 256*2:
         raise Exception("Palette can't have more than 256 colors!")
 
-    out += len(pal).to_bytes(4,"little")
-    for color in pal:
-        val = 0
-        val += color[2]<<10
-        val += color[1]<<5
-        val += color[0]
-        out += val.to_bytes(2, "little")
+    out += (len(pal)//2).to_bytes(4,"little")
+    out += pal
     
-    raw = list(img.getdata())
-    rows = [raw[x:x + width] for x in range(0, len(raw), width)]
-    tiles = []
+    raw = img.tobytes()
+    tiles = {} # tile -> index
     map = []
     for y in range(height//8):
         for x in range(width//8):
-            tile = []
-            for tile_y in range(8):
-                row = rows[y*8+tile_y][x*8:x*8+8]
-                tile += row
-
-            is_in_tiles = False
-            for t in tiles: #TODO: checking flipping axis
-                if t == tile:
-                    is_in_tiles = True
-                    map.append(tiles.index(t))
-                
-            if not is_in_tiles:
-                tiles.append(tile)
-                map.append(max(map)+1 if map != [] else 0)
+            tile = tiling.get_tile(raw, width, x, y)
+
+            #TODO: checking flipping axis
+            map.append(tiles.setdefault(tile, len(tiles)))
     
-    tiles_out = b''
-    for tile in tiles:
-        tiles_out += bytes(tile)
+    tiles_out = b''.join(tiles)
     
     if len(tiles) >= 2**10:
         raise Exception("Image too complex and can't be imported")
@@ -198,8 +138,156 @@ def create(input, output=None):
     for tile in map:
         out += tile.to_bytes(2, "little") #TODO: this is without axis-flipping yet
 
-    # TODO: use ideal compression method, or let user override
-    out = lz10.compress(out)
-    output.write(b"\x02\x00\x00\x00")
-    output.write(out)
-    output.close()
\ No newline at end of file
+    return out
+
+# Extension of the output file for every image format
+IMAGE_FORMATS = {"png": "png", "png-fast": "png", "raw": "raw", "npy": "npy"}
+
+def save_image(img, output, image_format = "png", compress_level = None):
+    """
+    Saves an indexed image in one of the IMAGE_FORMATS:
+    - "png" and "png-fast": a PNG, with zlib's compression level `compress_level` (by default 6 for "png" and 1 for "png-fast")
+    - "raw": Flora's raw format (see `rawimage`), which is just the size, the palette and the pixels, with no encoding
+    - "npy": two NumPy arrays, the pixels in `output` and the palette next to it (see `rawimage.write_npy_image`)
+    """
+    if image_format in ("png", "png-fast"):
+        if compress_level is None:
+            compress_level = 1 if image_format == "png-fast" else 6
+        with span("png.encode", img.size[0] * img.size[1]):
+            img.save(output, "PNG", compress_level=compress_level)
+    elif image_format == "raw":
+        with span("raw.write", img.size[0] * img.size[1]):
+            with open(output, "wb") as f:
+                rawimage.write_raw(f, img)
+    elif image_format == "npy":
+        with span("npy.write", img.size[0] * img.size[1]):
+            rawimage.write_npy_image(output, img)
+    else:
+        raise Exception(f"Unknown image format '{image_format}'!")
+
+def open_image(path):
+    """
+    Opens an image to be made into a BG: a raw or .npy image (see `save_image`), or anything that PIL can open.
+    """
+    if path.lower().endswith((".raw", ".npy")):
+        with rawimage.open_image(path) as raw:
+            return raw.to_image()
+    img = Image.open(path)
+    img.load()
+    return img
+
+@cli.command(
+                name = "extract",
+                help="Converts a texture ARC file into a PNG (or a raw/.npy image, see --image-format).",
+                no_args_is_help = True
+            )
+@click.argument("input")
+@click.argument("output", required=False)
+@click.option("--full-range", is_flag=True, help="Expand the colors to the full 0-255 range, instead of multiplying them by 8. Both give back the same ARC file.")
+@click.option("--image-format", "-i", type=click.Choice(list(IMAGE_FORMATS)), default="png", help="Output format: png, png-fast (less compressed, but much faster to write), raw (size, palette and pixels, with no encoding) or npy (NumPy arrays of the pixels and the palette, in OUTPUT and OUTPUT with its .npy ending exchanged for .pal.npy).")
+@click.option("--compress-level", type=click.IntRange(0, 9), default=None, help="zlib compression level for PNGs, from 0 (none) to 9 (smallest). Defaults to 6, or 1 for png-fast.")
+@click.option("--tiles", type=(int, int, int, int), default=None, metavar="X Y W H", help="Only decode this rectangle of the image, in tiles (8x8 pixels).")
+@click.option("--thumbnail", "as_thumbnail", is_flag=True, help="Write a 1/8 scale RGB thumbnail (one pixel per tile, with its average color) instead of the full image. Not supported by the raw and npy formats.")
+def extract(input, output=None, full_range=False, image_format="png", compress_level=None, tiles=None, as_thumbnail=False):
+    if output is None:
+        output = f"{input}.{IMAGE_FORMATS[image_format]}"
+    
+    from project import open_file
+
+    project, name = open_file(input)
+    if as_thumbnail:
+        if image_format not in ("png", "png-fast"):
+            raise Exception("Thumbnails can only be saved as PNG!")
+        img = thumbnail(project.read(name), full_range)
+    elif tiles is not None:
+        img = to_image(project.read(name), full_range, tiles)
+    else:
+        img = project.bg(name, full_range)
+    save_image(img, output, image_format, compress_level)
+
+@cli.command(
+                name = "create",
+                help = "Makes a texture ARC file from a PNG",
+                no_args_is_help = True
+            )
+@click.argument("input")
+@click.argument("output", required=False)
+@click.option("--colors", "-c", type=click.IntRange(1, 256), default=256, help="Maximum number of colors, if the image has to be converted to an indexed image.")
+@click.option("--tile-aware", "-t", count=True, type=click.IntRange(0, 4, clamp=True), help="Merge tiles that look almost the same, to lower the number of unique tiles (for images that are too complex). Can be repeated (up to -tttt) to merge more tiles.")
+def create(input, output=None, colors=256, tile_aware=0):
+    if output is None:
+        output = input
+        if output.lower().endswith((".png", ".raw", ".npy")):
+            output = output[:-4]
+        if not output.lower().endswith(".arc"):
+            output = output + ".arc"
+    
+    with span("png.decode"):
+        img = open_image(input)
+    output = open(output, "wb")
+    output.write(from_image(img, colors, tile_aware))
+    output.close()
+
+def _make_thumbnail(path, full_range):
+    # Runs in a worker process. Returns the size and pixels of the thumbnail, or the error if the file isn't a valid BG
+    try:
+        img = thumbnail(open(path, "rb").read(), full_range)
+    except Exception as e:
+        return None, str(e)
+    return img.size, img.tobytes()
+
+@cli.command(
+                name = "thumbs",
+                no_args_is_help = True,
+                options_metavar = "[options]"
+            )
+@click.argument("input", type=click.Path(exists=True, file_okay=False))
+@click.argument("output")
+@click.option("--recursive", "-r", is_flag=True, help="Also include the ARC files in subdirectories.")
+@click.option("--columns", "-c", type=click.IntRange(1), default=None, help="Number of thumbnails per row. Defaults to a roughly square atlas.")
+@click.option("--jobs", "-j", type=int, default=None, help="Number of worker processes. Defaults to the number of CPUs.")
+@click.option("--full-range", is_flag=True, help="Expand the colors to the full 0-255 range, instead of multiplying them by 8.")
+def thumbs(input, output, recursive = False, columns = None, jobs = None, full_range = False):
+    """
+    Makes a single atlas image (a contact sheet) with a 1/8 scale thumbnail of every texture ARC file in the directory INPUT.
+
+    The position of every file's thumbnail in the atlas is written to a JSON file next to OUTPUT (e.g. atlas.png -> atlas.json).
+    Files that aren't valid texture ARCs are skipped.
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(input):
+        dirnames.sort()
+        paths += [os.path.join(dirpath, f) for f in sorted(filenames) if f.lower().endswith(".arc")]
+        if not recursive:
+            break
+    if not paths:
+        raise Exception("No ARC files found!")
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        results = list(pool.map(_make_thumbnail, paths, [full_range] * len(paths), chunksize=16))
+
+    found = []
+    for path, (size, data) in zip(paths, results):
+        if size is None:
+            print(f"Skipping {path}: {data}")
+        else:
+            found.append((os.path.relpath(path, input).replace("\\", "/"), size, data))
+    if not found:
+        raise Exception("None of the ARC files are valid textures!")
+
+    if columns is None:
+        columns = math.ceil(math.sqrt(len(found)))
+    cell_w = max(size[0] for _, size, _ in found)
+    cell_h = max(size[1] for _, size, _ in found)
+    atlas = Image.new("RGB", (cell_w * min(columns, len(found)), cell_h * math.ceil(len(found) / columns)))
+    index = {}
+    for i, (name, size, data) in enumerate(found):
+        x, y = i % columns * cell_w, i // columns * cell_h
+        atlas.paste(Image.frombytes("RGB", size, data), (x, y))
+        index[name] = {"x": x, "y": y, "width": size[0], "height": size[1]}
+
+    with span("png.encode", atlas.size[0] * atlas.size[1]):
+        atlas.save(output)
+    with open(os.path.splitext(output)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=4)
+    print(f"{len(found)} thumbnails written to {output}.")
@@ -1,2 +1,24 @@
 # TODO: all of this should be upstreamed into ndspy
-from . import rle, huffman
\ No newline at end of file
+from ndspy import lz10 as ndspy_lz10
+from . import lz10, lz11, rle, huffman
+from timings import span
+
+def decompress(data):
+    """
+    Decompress data that uses any of the known compression types (LZ10, LZ11, Huffman or RLE).
+    """
+    with span("decompress", len(data)):
+        for codec in (lz10, lz11, huffman, rle):
+            try:
+                return codec.decompress(data)
+            except TypeError:
+                # Not this format, try next one
+                pass
+    raise TypeError("Data doesn't use a known compression type")
+
+def compress(data):
+    """
+    Compress data with LZ10.
+    """
+    with span("compress", len(data)):
+        return ndspy_lz10.compress(data)
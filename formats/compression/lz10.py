@@ -0,0 +1,104 @@
+import struct
+
+def decompressed_size(data):
+    """
+    Size of the data once decompressed, as given by the LZ10 header.
+    """
+    if data[0] != 0x10:
+        raise TypeError("This isn't a LZ10-compressed file.")
+    return struct.unpack_from('<I', data)[0] >> 8
+
+def copy_reference(out, pos, disp, length):
+    """
+    Copies `length` bytes from `disp` bytes back in `out` to `pos`. Shared by the LZ10 and LZ11 decoders.
+
+    If the reference overlaps the bytes being written (disp < length), the data repeats every `disp` bytes,
+    so it's copied in chunks that double in size, instead of byte by byte.
+    """
+    src = pos - disp
+    if src < 0:
+        # References before the start of the data read zeros, as they do in ndspy
+        for i in range(length):
+            out[pos + i] = out[src + i] if src + i >= 0 else 0
+    elif length <= disp:
+        out[pos:pos + length] = out[src:src + length]
+    else:
+        done = 0
+        while done < length:
+            n = min(disp + done, length - done)
+            out[pos + done:pos + done + n] = out[src:src + n]
+            done += n
+
+def decompress_into(data, out):
+    """
+    Decompresses LZ10-compressed data into `out`, a preallocated writable buffer (like a bytearray) of at least `decompressed_size(data)` bytes.
+    Returns the number of bytes written.
+    """
+    size = decompressed_size(data)
+    if len(out) < size:
+        raise ValueError(f"Output buffer is too small ({len(out)} bytes, {size} needed)")
+    data = bytes(data)
+    end = len(data)
+    inPos, outPos = 4, 0
+
+    while outPos < size:
+        if inPos >= end:
+            raise EOFError("Invalid LZ10-compressed file: data stream is too short")
+        flags = data[inPos]; inPos += 1
+
+        if flags == 0 and inPos + 8 <= end:
+            # 8 literal bytes in a row
+            n = min(8, size - outPos)
+            out[outPos:outPos + n] = data[inPos:inPos + n]
+            inPos += n; outPos += n
+            continue
+
+        if inPos + 16 <= end and outPos + 8*18 <= size:
+            # The whole block is inside both the input and the output, so nothing has to be checked
+            for bit in (0x80, 0x40, 0x20, 0x10, 8, 4, 2, 1):
+                if flags & bit:
+                    b1 = data[inPos]
+                    disp = ((b1 & 0xF) << 8 | data[inPos + 1]) + 1
+                    length = (b1 >> 4) + 3
+                    inPos += 2
+                    if length <= disp <= outPos:
+                        out[outPos:outPos + length] = out[outPos - disp:outPos - disp + length]
+                    else:
+                        copy_reference(out, outPos, disp, length)
+                    outPos += length
+                else:
+                    out[outPos] = data[inPos]
+                    outPos += 1; inPos += 1
+            continue
+
+        for _ in range(8):
+            if outPos >= size:
+                break
+            if inPos >= end:
+                raise EOFError("Invalid LZ10-compressed file: data stream is too short")
+            if flags & 0x80:
+                if inPos + 2 > end:
+                    raise EOFError("Invalid LZ10-compressed file: data stream is too short")
+                b1 = data[inPos]; b2 = data[inPos + 1]; inPos += 2
+                length = min((b1 >> 4) + 3, size - outPos)
+                disp = ((b1 & 0xF) << 8 | b2) + 1
+                if length <= disp <= outPos:
+                    # The most common case, inlined
+                    out[outPos:outPos + length] = out[outPos - disp:outPos - disp + length]
+                else:
+                    copy_reference(out, outPos, disp, length)
+                outPos += length
+            else:
+                out[outPos] = data[inPos]
+                outPos += 1; inPos += 1
+            flags <<= 1
+
+    return size
+
+def decompress(data):
+    """
+    Decompress LZ10-compressed data.
+    """
+    out = bytearray(decompressed_size(data))
+    decompress_into(data, out)
+    return bytes(out)
@@ -0,0 +1,125 @@
+import struct
+
+from .lz10 import copy_reference
+
+def _header(data):
+    # Returns the decompressed size and where the compressed data starts.
+    # A size of 0 in the normal header means the real size is in the next 4 bytes.
+    if data[0] != 0x11:
+        raise TypeError("This isn't a LZ11-compressed file.")
+    size = struct.unpack_from('<I', data)[0] >> 8
+    if size == 0:
+        return struct.unpack_from('<I', data, 4)[0], 8
+    return size, 4
+
+def decompressed_size(data):
+    """
+    Size of the data once decompressed, as given by the LZ11 header.
+    """
+    return _header(data)[0]
+
+def decompress_into(data, out):
+    """
+    Decompresses LZ11-compressed data into `out`, a preallocated writable buffer (like a bytearray) of at least `decompressed_size(data)` bytes.
+    Returns the number of bytes written.
+    """
+    size, inPos = _header(data)
+    if len(out) < size:
+        raise ValueError(f"Output buffer is too small ({len(out)} bytes, {size} needed)")
+    data = bytes(data)
+    end = len(data)
+    outPos = 0
+
+    while outPos < size:
+        if inPos >= end:
+            raise EOFError("Invalid LZ11-compressed file: data stream is too short")
+        flags = data[inPos]; inPos += 1
+
+        if flags == 0 and inPos + 8 <= end:
+            # 8 literal bytes in a row
+            n = min(8, size - outPos)
+            out[outPos:outPos + n] = data[inPos:inPos + n]
+            inPos += n; outPos += n
+            continue
+
+        if inPos + 32 <= end:
+            # The whole block is inside the input, so only the end of the output has to be checked
+            for bit in (0x80, 0x40, 0x20, 0x10, 8, 4, 2, 1):
+                if outPos >= size:
+                    break
+                if flags & bit:
+                    b1 = data[inPos]
+                    indicator = b1 >> 4
+                    if indicator > 1:
+                        length = indicator + 1
+                        disp = ((b1 & 0xF) << 8 | data[inPos + 1]) + 1
+                        inPos += 2
+                    elif indicator == 0:
+                        b2 = data[inPos + 1]
+                        length = ((b1 & 0xF) << 4 | b2 >> 4) + 0x11
+                        disp = ((b2 & 0xF) << 8 | data[inPos + 2]) + 1
+                        inPos += 3
+                    else:
+                        b3 = data[inPos + 2]
+                        length = ((b1 & 0xF) << 12 | data[inPos + 1] << 4 | b3 >> 4) + 0x111
+                        disp = ((b3 & 0xF) << 8 | data[inPos + 3]) + 1
+                        inPos += 4
+                    length = min(length, size - outPos)
+                    if length <= disp <= outPos:
+                        out[outPos:outPos + length] = out[outPos - disp:outPos - disp + length]
+                    else:
+                        copy_reference(out, outPos, disp, length)
+                    outPos += length
+                else:
+                    out[outPos] = data[inPos]
+                    outPos += 1; inPos += 1
+            continue
+
+        for _ in range(8):
+            if outPos >= size:
+                break
+            if inPos >= end:
+                raise EOFError("Invalid LZ11-compressed file: data stream is too short")
+            if flags & 0x80:
+                # The top 4 bits of the first byte tell how the length is stored
+                b1 = data[inPos]
+                indicator = b1 >> 4
+                if indicator == 0:
+                    if inPos + 3 > end:
+                        raise EOFError("Invalid LZ11-compressed file: data stream is too short")
+                    b2, b3 = data[inPos + 1], data[inPos + 2]; inPos += 3
+                    length = ((b1 & 0xF) << 4 | b2 >> 4) + 0x11
+                    disp = ((b2 & 0xF) << 8 | b3) + 1
+                elif indicator == 1:
+                    if inPos + 4 > end:
+                        raise EOFError("Invalid LZ11-compressed file: data stream is too short")
+                    b2, b3, b4 = data[inPos + 1], data[inPos + 2], data[inPos + 3]; inPos += 4
+                    length = ((b1 & 0xF) << 12 | b2 << 4 | b3 >> 4) + 0x111
+                    disp = ((b3 & 0xF) << 8 | b4) + 1
+                else:
+                    if inPos + 2 > end:
+                        raise EOFError("Invalid LZ11-compressed file: data stream is too short")
+                    b2 = data[inPos + 1]; inPos += 2
+                    length = indicator + 1
+                    disp = ((b1 & 0xF) << 8 | b2) + 1
+                length = min(length, size - outPos)
+                if length <= disp <= outPos:
+                    # The most common case, inlined
+                    out[outPos:outPos + length] = out[outPos - disp:outPos - disp + length]
+                else:
+                    copy_reference(out, outPos, disp, length)
+                outPos += length
+            else:
+                out[outPos] = data[inPos]
+                outPos += 1; inPos += 1
+            flags <<= 1
+
+    return size
+
+def decompress(data):
+    """
+    Decompress LZ11-compressed data.
+    """
+    out = bytearray(decompressed_size(data))
+    decompress_into(data, out)
+    return bytes(out)
@@ -1,18 +1,22 @@
 import click
+import functools
 import json
-import os
 
 import parse
-from utils import cli_file_pairs, foreach_file_pair
+from timings import span
+from utils import cli_file_pairs, foreach_file_pair, load_data
 from version import v
 
 @click.group(help="Script-like format, also used to store puzzle parameters.",options_metavar='')
 def cli():
     pass
 
-dir_path = "/".join(os.path.dirname(os.path.realpath(__file__).replace("\\", "/")).split("/")[:-1])
-commands = json.load(open(f"{dir_path}/data/commands.json", encoding="utf-8"))
-commands_i = {val: key for key, val in commands.items()} # Inverted version of commands
+def get_commands():
+    return load_data("commands")
+
+@functools.lru_cache(maxsize=None)
+def get_commands_i():
+    return {val: key for key, val in get_commands().items()} # Inverted version of commands
 
 class GDSModeException (Exception):
     def __init__(self, mode):
@@ -23,11 +27,14 @@ class GDSModeException (Exception):
 class GDS:
     def __init__(self, file, mode="bin"): #modes: "bin"/"b", "json"/"j", "gda"/"a"
         if mode == "bin" or mode == "b":
-            self.from_gds(file)
+            with span("gds.parse", len(file)):
+                self.from_gds(file)
         elif mode == "json" or mode == "j":
-            self.from_json(file)
+            with span("gds.from_json", len(file)):
+                self.from_json(file)
         elif mode == "gda" or mode == "a":
-            self.from_old(file)
+            with span("gds.from_gda", len(file)):
+                self.from_old(file)
         else:
             raise GDSModeException(mode)
 
@@ -38,6 +45,7 @@ class GDS:
             return
         cmd_data = file[6:length+4]
         cmds = []
+        commands_i = get_commands_i()
 
         cmd = None
         params = []
@@ -99,36 +107,32 @@ class GDS:
     
     def from_old (self, file): #TODO: make this, so gds_old can be completely removed
         cmds = []
-        
-        for line in file.split("\n"):
-            data = {}
-            if line.startswith("#"):
-                continue
-
-            line, strings = parse.remove_strings(line)
-            line = line.rstrip().split(" ")
-            cmd = line[0]
+        commands = get_commands()
+        cmd = None
+        params = []
 
-            if cmd == "engine":
-                cmd = "0x1b"
-            elif cmd == "img_win":
-                cmd = "0x1f"
-            
-            cmd = int(cmd[2:], base=16)
-            params = []
-
-            for param in line[1:]:
-                if param.isdigit():
-                    params.append({"type":"int", "data":int(param)})
-                elif param.startswith("0x"):
-                    params.append({"type":"unknown-2", "data":int(param[2:], 16)})
-                elif param.startswith('"') and param.endswith('"'):
-                    param = strings[int(param[1:-1])]
-                    params.append({"type":"string", "data":param})
+        # Each line is a command (a known command name, or its number in hex) followed by its parameters
+        for kind, value, line, column in parse.tokenize_gda(file):
+            if kind == "newline":
+                if cmd is not None:
+                    cmds.append({"command":cmd, "parameters":params})
+                cmd = None
+                params = []
+            elif cmd is None:
+                if kind == "hex":
+                    cmd = value
+                elif kind == "name" and value in commands:
+                    cmd = commands[value]
                 else:
-                    raise Exception(f"Invalid GDA parameter: {param}")
-            
-            cmds.append({"command":cmd, "parameters":params})
+                    raise parse.GDAError(f"Invalid GDA command: {value!r}", line, column)
+            elif kind == "int":
+                params.append({"type":"int", "data":value})
+            elif kind == "hex":
+                params.append({"type":"unknown-2", "data":value})
+            elif kind == "string":
+                params.append({"type":"string", "data":value})
+            else:
+                raise parse.GDAError(f"Invalid GDA parameter: {value!r}", line, column)
 
         self.cmds = cmds
 
@@ -137,10 +141,20 @@ class GDS:
         return self.cmds[index]
     
     def to_json (self):
-        return json.dumps({"version": v, "data": self.cmds}, indent=4)
+        with span("gds.to_json") as s:
+            out = json.dumps({"version": v, "data": self.cmds}, indent=4)
+            s.add(len(out))
+        return out
     
     def to_gds (self):
+        with span("gds.encode") as s:
+            out = self._to_gds()
+            s.add(len(out))
+        return out
+
+    def _to_gds (self):
         out = b"\x00" * 2
+        commands = get_commands()
         for command in self.cmds:
             if type(command["command"]) == int:
                 out += command["command"].to_bytes(2, "little")
@@ -203,10 +217,12 @@ def unpack_json(input = None, output = None, recursive = False, quiet = False):
     In the file-to-file case, the paths are explicitly used as they are. Otherwise, if multiple input files were collected, or OUTPUT is a directory,
     an output path is inferred for each input file by exchanging the `.gds` file ending for `.json`, or otherwise appending the `.json` file ending.
     """
+    from project import open_file
+
     def process(input, output):
-        input = open(input, "rb").read()
+        project, name = open_file(input)
+        gds = project.gds(name)
         output = open(output, "w", encoding="utf-8")
-        gds = GDS(input)
         output.write(gds.to_json())
         output.close()
 
@@ -231,15 +247,137 @@ def create_json(input, output):
 
 @cli.command(
                 name="gdaimport",
-                help="Creates a GDS JSON file from the old GDA format.",
                 no_args_is_help = True
             )
-@click.argument("input")
-@click.argument("output")
-def create_from_gda(input, output):
-    input = open(input, encoding="utf-8").read()
-    output = open(output, "w", encoding="utf-8")
+@click.argument("input", type=click.Path(exists=True))
+@click.argument("output", required=False, type=click.Path(exists=False))
+@click.option("--recursive", "-r", is_flag=True, help="Recurse into subdirectories of the input directory to find more applicable files.")
+@click.option("--quiet", "-q", is_flag=True, help="Suppress all output. By default, operations involving multiple files will show a progressbar.")
+def create_from_gda(input, output = None, recursive = False, quiet = False):
+    """
+    Creates GDS JSON files from the old GDA format.
 
-    gds = GDS(input, "gda")
-    output.write(gds.to_json())
-    output.close()
+    INPUT can be a single file or a directory, in which case all the `.gda` files inside it are converted.
+    OUTPUT works the same way as in `gds extract`: the output file or directory, which by default is inferred from INPUT
+    by exchanging the `.gda` file ending for `.json`.
+    """
+    def process(input, output):
+        try:
+            gds = GDS(open(input, encoding="utf-8").read(), "gda")
+        except parse.GDAError as e:
+            raise Exception(f"{input}: {e}") from e
+        output = open(output, "w", encoding="utf-8")
+        output.write(gds.to_json())
+        output.close()
+
+    pairs = cli_file_pairs(input, output, in_ending=".gda", out_ending=".json", recursive=recursive)
+    foreach_file_pair(pairs, process, quiet=quiet)
+
+def load_script(path):
+    """
+    Loads a GDS script from a `.gds`, `.json` (as made by `gds extract`) or `.gda` file, going by its file ending.
+    `.gds` files are cached (see `project.open_file`), so the returned script shouldn't be modified.
+    """
+    from project import open_file
+
+    if path.lower().endswith(".json"):
+        return GDS(open(path, encoding="utf-8").read(), "json")
+    if path.lower().endswith(".gda"):
+        return GDS(open(path, encoding="utf-8").read(), "gda")
+    project, name = open_file(path)
+    return project.gds(name)
+
+def save_script(cmds, path):
+    """
+    Saves a list of GDS commands as JSON if `path` ends with `.json`, and as a `.gds` file otherwise.
+    """
+    gds = GDS(json.dumps({"data": cmds}), "json")
+    if path.lower().endswith(".json"):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(gds.to_json())
+    else:
+        with open(path, "wb") as f:
+            f.write(gds.to_bin())
+
+@cli.command(
+                name="diff",
+                no_args_is_help = True,
+                options_metavar = "[options]"
+            )
+@click.argument("old", type=click.Path(exists=True, dir_okay=False))
+@click.argument("new", type=click.Path(exists=True, dir_okay=False))
+@click.option("--context", "-U", type=int, default=3, help="Number of unchanged commands shown around each change.")
+@click.option("--json", "as_json", is_flag=True, help="Output the changes as JSON, as a list of changed command ranges.")
+def diff_scripts(old, new, context = 3, as_json = False):
+    """
+    Compares two GDS scripts command by command, showing which commands were removed (-) and added (+), like a unified diff.
+
+    OLD and NEW can be `.gds` files or JSON files made by `gds extract`. Commands are the same if they have the same opcode and parameters,
+    whether the opcode is written as a name or a number. Positions in the hunk headers are command numbers, starting at 1.
+    """
+    from .gdsdiff import diff, diff_lines
+
+    old_cmds, new_cmds = load_script(old).cmds, load_script(new).cmds
+    with span("gds.diff", len(old_cmds) + len(new_cmds)):
+        ops = [op for op in diff(old_cmds, new_cmds) if op[0] != "equal"]
+    if as_json:
+        print(json.dumps([{"change": tag, "old": [i1, i2], "new": [j1, j2], "removed": old_cmds[i1:i2], "added": new_cmds[j1:j2]}
+                          for tag, i1, i2, j1, j2 in ops], indent=4, ensure_ascii=False))
+        return
+    if not ops:
+        print("The scripts are the same.")
+        return
+    print(f"--- {old}")
+    print(f"+++ {new}")
+    for line in diff_lines(old_cmds, new_cmds, context):
+        print(line)
+    removed = sum(i2 - i1 for _, i1, i2, _, _ in ops)
+    added = sum(j2 - j1 for _, _, _, j1, j2 in ops)
+    print(f"{removed} command(s) removed, {added} added.")
+
+@cli.command(
+                name="merge3",
+                no_args_is_help = True,
+                options_metavar = "[options]"
+            )
+@click.argument("base", type=click.Path(exists=True, dir_okay=False))
+@click.argument("ours", type=click.Path(exists=True, dir_okay=False))
+@click.argument("theirs", type=click.Path(exists=True, dir_okay=False))
+@click.argument("output", type=click.Path(dir_okay=False))
+@click.option("--prefer", type=click.Choice(["ours", "theirs"]), default=None, help="Resolve conflicts by taking this side's version, instead of failing.")
+def merge_scripts(base, ours, theirs, output, prefer = None):
+    """
+    Merges two modified versions (OURS and THEIRS) of the same GDS script, given the original (BASE) they were both made from,
+    and saves the result to OUTPUT (as JSON if it ends with `.json`, and as a `.gds` file otherwise).
+
+    Changes that only one side made, or that both sides made the same way, are merged automatically.
+    If both sides changed the same commands in different ways, the conflicts are listed and nothing is saved (exit code 1),
+    unless --prefer picks the side that wins.
+    """
+    from .gdsdiff import command_line, merge3
+
+    base_cmds, our_cmds, their_cmds = load_script(base).cmds, load_script(ours).cmds, load_script(theirs).cmds
+    with span("gds.merge3", len(base_cmds) + len(our_cmds) + len(their_cmds)):
+        merged, conflicts = merge3(base_cmds, our_cmds, their_cmds)
+
+    for conflict in conflicts:
+        print(f"Conflict at command {conflict['position'] + 1}:")
+        for side, path in (("base", base), ("ours", ours), ("theirs", theirs)):
+            print(f"  {side} ({path}):")
+            for cmd in conflict[side]:
+                print(f"    {command_line(cmd)}")
+            if not conflict[side]:
+                print("    (nothing)")
+    if conflicts and prefer is None:
+        print(f"{len(conflicts)} conflict(s): nothing was saved. Fix them by hand, or use --prefer ours/theirs.")
+        raise SystemExit(1)
+    if prefer == "theirs":
+        # The merged commands have our side of every conflict; swap in theirs, from the end so the positions stay valid
+        for conflict in reversed(conflicts):
+            pos = conflict["position"]
+            merged[pos:pos + len(conflict["ours"])] = conflict["theirs"]
+
+    save_script(merged, output)
+    if conflicts:
+        print(f"{len(conflicts)} conflict(s) resolved with the {prefer.upper()} version.")
+    print(f"Merged {len(merged)} commands into {output}.")
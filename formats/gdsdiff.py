@@ -0,0 +1,281 @@
+'''Command-level diffs and three-way merges of GDS scripts'''
+import json
+
+# Regions without unique commands are diffed with Myers' algorithm, which stops looking for the smallest diff
+# once more than this many commands have to be added or removed (from each end), to stay fast on very different scripts
+MAX_EDIT_COST = 256
+
+def command_key(cmd, commands = None):
+    """
+    Everything that identifies a command (its opcode and its parameters), as a hashable tuple.
+    Known command names are turned into their opcodes (`commands` is the table from `gds.get_commands`), so both spellings compare equal.
+    """
+    op = cmd["command"]
+    if commands is not None and isinstance(op, str) and op in commands:
+        op = commands[op]
+    return (op,) + tuple((p["type"], p.get("data")) for p in cmd["parameters"])
+
+def command_line(cmd):
+    """
+    A command as a single line of text, for diffs and conflict reports.
+    """
+    params = []
+    for param in cmd["parameters"]:
+        if param["type"] == "int":
+            params.append(str(param["data"]))
+        elif param["type"] == "string":
+            params.append(json.dumps(param["data"], ensure_ascii=False))
+        elif "data" in param:
+            params.append(f"{param['type']}:{param['data']}")
+        else:
+            params.append(param["type"])
+    return " ".join([str(cmd["command"])] + params)
+
+def hash_commands(*scripts):
+    """
+    Turns lists of commands into lists of ints, where two commands get the same int only if they're the same (see `command_key`).
+    Comparing ints is much faster than comparing the commands themselves, and unlike real hashes there can't be collisions.
+    """
+    from .gds import get_commands
+
+    commands = get_commands()
+    ids = {}
+    return [[ids.setdefault(command_key(cmd, commands), len(ids)) for cmd in script] for script in scripts]
+
+def _middle_snake(a, b, a_lo, a_hi, b_lo, b_hi, max_cost = MAX_EDIT_COST):
+    # Myers' linear space search, from both ends of a[a_lo:a_hi] and b[b_lo:b_hi] at once, for the middle of the smallest diff.
+    # Returns the (x, y, u, v) ends of a run of matching items in the middle (relative to a_lo and b_lo), or, after more than
+    # `max_cost` steps from each end, the point the search from the start got furthest to, as (x, y, x, y).
+    # Both regions must be non-empty, and start and end with different items.
+    n, m = a_hi - a_lo, b_hi - b_lo
+    delta = n - m
+    odd = delta % 2 != 0
+    limit = min((n + m + 1) // 2, max_cost)
+    offset = limit + 1
+    forward = [0] * (2 * limit + 3) # furthest x on each diagonal k = x - y, from the start
+    backward = [0] * (2 * limit + 3) # furthest distance back from the end on each diagonal, from the end
+    for d in range(limit + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if odd and -(d - 1) <= delta - k <= d - 1 and x + backward[offset + delta - k] >= n:
+                return x0, y0, x, y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a_hi - 1 - x] == b[b_hi - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d and x + forward[offset + delta - k] >= n:
+                return n - x, m - y, n - x0, m - y0
+    # Too many changes: split the region where the search from the start got furthest, without looking for the smallest diff
+    x, y = max(((forward[offset + k], forward[offset + k] - k) for k in range(-limit, limit + 1, 2)), key=lambda p: p[0] + p[1])
+    x, y = min(max(x, 0), n), min(max(y, 0), m)
+    if (x, y) in ((0, 0), (n, m)):
+        x, y = n // 2, m // 2
+    return x, y, x, y
+
+def _myers(a, b, a_lo, a_hi, b_lo, b_hi):
+    # Matching (i, j) pairs of a[a_lo:a_hi] and b[b_lo:b_hi], splitting the regions at their middle snake until nothing is left
+    out = []
+    stack = [(a_lo, a_hi, b_lo, b_hi)]
+    while stack:
+        a_lo, a_hi, b_lo, b_hi = stack.pop()
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            out.append((a_lo, b_lo))
+            a_lo += 1
+            b_lo += 1
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+            out.append((a_hi, b_hi))
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+        x, y, u, v = _middle_snake(a, b, a_lo, a_hi, b_lo, b_hi)
+        out += [(a_lo + x + i, b_lo + y + i) for i in range(u - x)]
+        stack.append((a_lo, a_lo + x, b_lo, b_lo + y))
+        stack.append((a_lo + u, a_hi, b_lo + v, b_hi))
+    return out
+
+def _unique_anchors(a, b, a_lo, a_hi, b_lo, b_hi):
+    # Patience diff: the items that appear exactly once in both ranges, and the longest run of them that's in the same order in both
+    count_a, count_b = {}, {}
+    for i in range(a_lo, a_hi):
+        count_a[a[i]] = count_a.get(a[i], 0) + 1
+    pos_b = {}
+    for j in range(b_lo, b_hi):
+        count_b[b[j]] = count_b.get(b[j], 0) + 1
+        pos_b[b[j]] = j
+    pairs = [(i, pos_b[a[i]]) for i in range(a_lo, a_hi) if count_a[a[i]] == 1 and count_b.get(a[i]) == 1]
+
+    # Longest increasing subsequence of the positions in b (patience sorting)
+    tails = [] # index in pairs of the last item of the best sequence of each length
+    prev = [None] * len(pairs)
+    tail_values = []
+    for k, (_, j) in enumerate(pairs):
+        lo, hi = 0, len(tail_values)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tail_values[mid] < j:
+                lo = mid + 1
+            else:
+                hi = mid
+        prev[k] = tails[lo - 1] if lo > 0 else None
+        if lo == len(tails):
+            tails.append(k)
+            tail_values.append(j)
+        else:
+            tails[lo] = k
+            tail_values[lo] = j
+    out = []
+    k = tails[-1] if tails else None
+    while k is not None:
+        out.append(pairs[k])
+        k = prev[k]
+    return out[::-1]
+
+def matches(a, b):
+    """
+    Matches the items of two sequences with a patience diff (falling back to Myers' diff where there are no unique items),
+    returning the (i, j) pairs where a[i] and b[j] are the same item, in order.
+    """
+    out = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a_lo, a_hi, b_lo, b_hi = stack.pop()
+        # The common start and end are always matched
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            out.append((a_lo, b_lo))
+            a_lo += 1
+            b_lo += 1
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+            out.append((a_hi, b_hi))
+        if a_lo == a_hi or b_lo == b_hi:
+            continue
+        anchors = _unique_anchors(a, b, a_lo, a_hi, b_lo, b_hi)
+        if not anchors:
+            out += _myers(a, b, a_lo, a_hi, b_lo, b_hi)
+            continue
+        # Diff the gaps between the anchors on their own
+        for i, j in anchors:
+            out.append((i, j))
+            stack.append((a_lo, i, b_lo, j))
+            a_lo, b_lo = i + 1, j + 1
+        stack.append((a_lo, a_hi, b_lo, b_hi))
+    out.sort()
+    return out
+
+def opcodes(a, b):
+    """
+    Like difflib's `get_opcodes`: ("equal" / "replace" / "delete" / "insert", i1, i2, j1, j2) tuples that turn a into b.
+    """
+    out = []
+    i = j = 0
+    for mi, mj in matches(a, b) + [(len(a), len(b))]:
+        if i < mi and j < mj:
+            out.append(("replace", i, mi, j, mj))
+        elif i < mi:
+            out.append(("delete", i, mi, j, j))
+        elif j < mj:
+            out.append(("insert", i, i, j, mj))
+        if mi < len(a):
+            if out and out[-1][0] == "equal" and out[-1][2] == mi:
+                out[-1] = ("equal", out[-1][1], mi + 1, out[-1][3], mj + 1)
+            else:
+                out.append(("equal", mi, mi + 1, mj, mj + 1))
+        i, j = mi + 1, mj + 1
+    return out
+
+def diff(old, new):
+    """
+    Compares two lists of GDS commands, returning the opcodes (see `opcodes`) that turn `old` into `new`.
+    """
+    return opcodes(*hash_commands(old, new))
+
+def diff_lines(old, new, context = 3):
+    """
+    A unified diff of two lists of GDS commands, one command per line, as a list of lines (without the file headers).
+    Hunk positions are command indices, starting at 1.
+    """
+    ops = diff(old, new)
+    out = []
+    # Group the changes into hunks, each one with up to `context` unchanged commands around it
+    groups = []
+    for op in ops:
+        if op[0] != "equal":
+            if groups and op[1] - groups[-1][-1][2] <= 2 * context:
+                groups[-1].append(op)
+            else:
+                groups.append([op])
+    for group in groups:
+        i1 = max(group[0][1] - context, 0)
+        j1 = max(group[0][3] - context, 0)
+        i2 = min(group[-1][2] + context, len(old))
+        j2 = min(group[-1][4] + context, len(new))
+        out.append(f"@@ -{i1 + 1},{i2 - i1} +{j1 + 1},{j2 - j1} @@")
+        i, j = i1, j1
+        for tag, a1, a2, b1, b2 in group:
+            out += [" " + command_line(cmd) for cmd in old[i:a1]]
+            out += ["-" + command_line(cmd) for cmd in old[a1:a2]]
+            out += ["+" + command_line(cmd) for cmd in new[b1:b2]]
+            i, j = a2, b2
+        out += [" " + command_line(cmd) for cmd in old[i:i2]]
+    return out
+
+def _sync_regions(base_a, base_b, len_base, len_a, len_b):
+    # The regions where the base and both other versions are the same, as (base, a, b) start positions and a length,
+    # from the (base, a) and (base, b) matches. Ends with an empty region at the end of all three.
+    in_a = dict(base_a)
+    in_b = dict(base_b)
+    out = []
+    for i in range(len_base):
+        if i in in_a and i in in_b:
+            j, k = in_a[i], in_b[i]
+            if out and out[-1][0] + out[-1][3] == i and out[-1][1] + out[-1][3] == j and out[-1][2] + out[-1][3] == k:
+                out[-1][3] += 1
+            else:
+                out.append([i, j, k, 1])
+    out.append([len_base, len_a, len_b, 0])
+    return out
+
+def merge3(base, ours, theirs):
+    """
+    Three-way merge of GDS scripts (lists of commands): the changes between `base` and `ours`, and between `base` and `theirs`, are combined.
+    Returns the merged commands and a list of conflicts, where both sides changed the same commands in different ways.
+    Every conflict is a dict with the "base", "ours" and "theirs" versions of the commands, and the "position" of the conflict in the merged
+    commands; the merged commands have the `ours` version of conflicting changes.
+    """
+    h_base, h_ours, h_theirs = hash_commands(base, ours, theirs)
+    regions = _sync_regions(matches(h_base, h_ours), matches(h_base, h_theirs), len(base), len(ours), len(theirs))
+
+    merged = []
+    conflicts = []
+    i = j = k = 0
+    for ri, rj, rk, size in regions:
+        # The unstable part before the region, where at least one side changed something
+        chunk_base, chunk_ours, chunk_theirs = h_base[i:ri], h_ours[j:rj], h_theirs[k:rk]
+        if chunk_ours == chunk_base or chunk_ours == chunk_theirs:
+            merged += theirs[k:rk]
+        elif chunk_theirs == chunk_base:
+            merged += ours[j:rj]
+        else:
+            conflicts.append({"position": len(merged), "base": base[i:ri], "ours": ours[j:rj], "theirs": theirs[k:rk]})
+            merged += ours[j:rj]
+        merged += ours[rj:rj + size]
+        i, j, k = ri + size, rj + size, rk + size
+    return merged, conflicts
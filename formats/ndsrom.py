@@ -1,16 +1,159 @@
+import contextlib
+import hashlib
 import json
-from ndspy import rom
+import mmap
+from ndspy import fnt, rom
 import os
+import struct
 
-dir_path = "/".join(os.path.dirname(os.path.realpath(__file__).replace("\\", "/")).split("/")[:-1])
-titles = json.load(open(f"{dir_path}/data/titles.json", encoding="utf-8"))
+from timings import span
+from utils import cache_dir, load_data
 
-def load(romfile, long=False, layton_only=True):
+_last_rom = None
+
+def open_rom(path):
+    """
+    Parses a ROM file with ndspy.
+
+    The last parsed ROM is kept around, so that a long-running process (like `flora serve`) can reuse it for as long as the file doesn't change.
+    """
+    global _last_rom
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if _last_rom is None or _last_rom[0] != key:
+        with span("ndsrom.load", stat.st_size):
+            _last_rom = (key, rom.NintendoDSRom.fromFile(path))
+    return _last_rom[1]
+
+@contextlib.contextmanager
+def map_rom(path):
+    """
+    Memory-maps a ROM file (read-only), so that its files can be read without loading the whole ROM into memory.
+    """
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+def rom_files(data):
+    """
+    Lists every file in a ROM's filesystem as (path, start, end) tuples, reading only the header, FNT and FAT.
+    `data` is the contents of the ROM, as any bytes-like object (e.g. from `map_rom`).
+    """
+    fnt_offset, fnt_size, fat_offset, fat_size = struct.unpack_from("<4I", data, 0x40)
+    root = fnt.load(bytes(data[fnt_offset:fnt_offset+fnt_size]))
+    fat = bytes(data[fat_offset:fat_offset+fat_size])
+
+    out = []
+    def walk(folder, prefix):
+        for i, name in enumerate(folder.files):
+            start, end = struct.unpack_from("<2I", fat, (folder.firstID + i) * 8)
+            out.append((prefix + name, start, end))
+        for name, subfolder in folder.folders:
+            walk(subfolder, f"{prefix}{name}/")
+    walk(root, "")
+    return out
+
+def rom_hash(path):
+    """
+    SHA-1 of a whole ROM file, as a hex string.
+    Hashes are remembered (in the "roms" cache) for as long as the file's mtime and size don't change, so a ROM is only hashed once.
+    """
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir("roms"), "hashes.json")
+    try:
+        index = json.load(open(index_path, encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        index = {}
+    if index.get(path, [None])[:2] == [stat.st_mtime_ns, stat.st_size]:
+        return index[path][2]
+
+    with map_rom(path) as data:
+        with span("ndsrom.hash", len(data)):
+            digest = hashlib.sha1(data).hexdigest()
+    index[path] = [stat.st_mtime_ns, stat.st_size, digest]
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=4)
+    os.replace(index_path + ".tmp", index_path)
+    return digest
+
+HEADER_SIZE = 0x200
+
+def rom_info(data):
+    """
+    The game code and revision of a ROM, from its header.
+    """
+    return data[0xC:0x10].decode("ascii", "replace"), data[0x1E]
+
+def tables_hash(data):
+    """
+    SHA-1 of the parts of a ROM that describe its filesystem: the header, the FNT and the FAT.
+    Only these few KB have to be read, so it's a quick way to tell whether any file was added, removed, moved or resized.
+    """
+    fnt_offset, fnt_size, fat_offset, fat_size = struct.unpack_from("<4I", data, 0x40)
+    h = hashlib.sha1(data[:HEADER_SIZE])
+    h.update(data[fnt_offset:fnt_offset+fnt_size])
+    h.update(data[fat_offset:fat_offset+fat_size])
+    return h.hexdigest()
+
+def compare_files(expected, actual, key = lambda f: f):
+    """
+    Compares two {path: [size, hash]} dicts (`key` picks what's compared), returning the modified, missing and added paths.
+    """
+    return {
+        "modified": sorted(p for p in expected.keys() & actual.keys() if key(expected[p]) != key(actual[p])),
+        "missing": sorted(expected.keys() - actual.keys()),
+        "added": sorted(actual.keys() - expected.keys()),
+    }
+
+def clean_dumps(data, database):
+    """
+    The entries of a fingerprint database (see verify.py) for the same game and revision as the ROM in `data`, by ROM hash.
+    """
+    id, version = rom_info(data)
+    return {key: entry for key, entry in database["roms"].items() if (entry["id"], entry["version"]) == (id, version)}
+
+def closest_dump(candidates, files, key = lambda f: f):
+    """
+    Compares the files of a modified ROM with the clean dump (out of `candidates`) that has the most files in common with it.
+    """
+    best = max(candidates.values(), key=lambda entry: sum(1 for p, f in files.items() if p in entry["files"] and key(entry["files"][p]) == key(f)))
+    return dict(compare_files(best["files"], files, key), status="modified", match=best["name"])
+
+def quick_verify(path, database = None):
+    """
+    Checks a ROM against the clean dumps in the fingerprint database, reading only its header, FNT and FAT
+    (see `verify.verify`, which this is the `quick` mode of). Files are compared by size only.
+    """
+    if database is None:
+        database = load_data("fingerprints")
+    with map_rom(path) as data:
+        candidates = clean_dumps(data, database)
+        if not candidates:
+            return {"status": "unknown", "match": None, "modified": [], "missing": [], "added": []}
+        with span("verify.quick", HEADER_SIZE):
+            tables = tables_hash(data)
+            sizes = {path: end - start for path, start, end in rom_files(data)}
+
+    for entry in candidates.values():
+        if entry["tables"] == tables:
+            return {"status": "clean", "match": entry["name"], "modified": [], "missing": [], "added": []}
+    # Compare to the dump with the most files of the same size
+    return closest_dump(candidates, {path: [size] for path, size in sizes.items()}, key=lambda f: f[0])
+
+def load(romfile, long=False, layton_only=True, assume_yes=False):
+    """
+    Loads a Professor Layton ROM, printing which game it is. Returns the ndspy ROM, its game code and the game's title.
+    With `assume_yes`, untested games are loaded without asking for confirmation.
+    """
+    path = romfile
     print("Loading ROM...")
-    romfile = rom.NintendoDSRom.fromFile(romfile)
+    romfile = open_rom(romfile)
     print("ROM loaded!")
     
     id = romfile.idCode.decode("ASCII")
+    titles = load_data("titles")
     if id not in titles["roms"]:
         raise Exception(f"Game supplied ({id}) is not a Professor Layton DS game!")
     title = ""
@@ -25,8 +168,12 @@ def load(romfile, long=False, layton_only=True):
             raise Exception("Currently, this game is not supported by Flora!")
         elif id not in titles["tested_roms"]:
             print("\nWarning: this game has not been tested properly with Flora, so errors may arise.")
-            ans = input("Continue? (y/N) ")
-            if ans.lower() != "y":
-                quit()
-        #TODO: check checksum, to see if it's a modified file or not
+            if not assume_yes:
+                ans = input("Continue? (y/N) ")
+                if ans.lower() != "y":
+                    quit()
+        # Only the filesystem tables are checked here; `flora verify` does the full check
+        result = quick_verify(path)
+        if result["status"] == "modified":
+            print(f"Note: this ROM has been modified (it doesn't match {result['match']}).")
     return romfile, id, title
\ No newline at end of file
@@ -0,0 +1,52 @@
+'''Conversion of whole palettes between the DS's BGR555 colors and RGB888'''
+import functools
+import sys
+from array import array
+
+@functools.lru_cache(maxsize=None)
+def _decode_table(full_range):
+    # Every possible BGR555 color, already converted to its 3 RGB888 bytes
+    if full_range:
+        expand = [(c << 3) | (c >> 2) for c in range(32)]
+    else:
+        expand = [c << 3 for c in range(32)]
+    return [bytes((expand[c & 0x1f], expand[c >> 5 & 0x1f], expand[c >> 10 & 0x1f])) for c in range(0x8000)]
+
+# Truncates an 8-bit channel to 5 bits
+_truncate = bytes(c >> 3 for c in range(256))
+
+def _colors(data):
+    colors = array("H", bytes(data))
+    if sys.byteorder == "big":
+        colors.byteswap()
+    return colors
+
+def decode(data, full_range = False):
+    """
+    Converts a BGR555 palette (2 bytes per color, little endian) into RGB888 (3 bytes per color, as used by PIL).
+
+    By default each 5-bit channel is expanded by multiplying it by 8, so that encoding it again gives back the same colors.
+    With `full_range`, the `(v<<3)|(v>>2)` expansion is used instead, which maps the brightest value to 255.
+    Both of them give back the original palette with `encode`.
+    """
+    table = _decode_table(full_range)
+    # The top bit is unused, but some files set it anyway
+    return b"".join([table[c & 0x7fff] for c in _colors(data)])
+
+def to_colors(rgb):
+    """
+    Converts RGB888 data (3 bytes or ints per color) into a list of 15-bit BGR555 color values.
+    The lowest 3 bits of every channel are discarded.
+    """
+    rgb = bytes(rgb).translate(_truncate)
+    return [r | g << 5 | b << 10 for r, g, b in zip(rgb[0::3], rgb[1::3], rgb[2::3])]
+
+def encode(rgb):
+    """
+    Converts an RGB888 palette (3 bytes or ints per color, as given by PIL) into BGR555 (2 bytes per color, little endian).
+    The lowest 3 bits of every channel are discarded.
+    """
+    colors = array("H", to_colors(rgb))
+    if sys.byteorder == "big":
+        colors.byteswap()
+    return colors.tobytes()
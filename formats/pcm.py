@@ -1,15 +1,103 @@
 import click
-from ndspy import lz10
+import json
 import os
+import re
+import shutil
+
+from formats import compression
+from timings import span
 
 @click.group(help="Archive/pack format, used to store text files.",options_metavar='')
 def cli():
     pass
 
+def padding(size):
+    return -size % 16
+
+def member_header(name, size):
+    """
+    Builds the 0x20 byte header of a file entry inside a PCM, for a file with `size` bytes of data.
+    """
+    if len(name) > 16:
+        raise Exception("File names longer than 16 characters (including extension) are not supported.")
+    header = {
+        "header_size": 0x20,
+        "file_size": 0x20 + size + padding(size),
+        "reserved": 0,
+        "data_size": size,
+        "name": name.encode("ASCII") + b"\x00" * (16 - len(name))
+    }
+    out = b''
+    out += header['header_size'].to_bytes(4, "little")
+    out += header['file_size'].to_bytes(4, "little")
+    out += header['reserved'].to_bytes(4, "little")
+    out += header['data_size'].to_bytes(4, "little")
+    out += header['name']
+    return out
+
+def member(name, content):
+    """
+    Builds a single file entry of a PCM (its 0x20 byte header, contents and padding).
+    """
+    return member_header(name, len(content)) + content + b"\x00" * padding(len(content))
+
+def pcm_header(file_size, num_files):
+    return 0x10.to_bytes(4, "little") + file_size.to_bytes(4, "little") + num_files.to_bytes(4, "little") + b"LPCK"
+
+def pack(paths, names, output = None):
+    """
+    Builds a PCM straight from the files at `paths`, without reading them all into memory first.
+
+    The size of every file is taken from the filesystem, so that the whole PCM can be laid out in advance.
+    If `output` (an open binary file) is given, the PCM is streamed into it one file at a time. Otherwise, the files are read into
+    a single preallocated buffer, which is returned.
+    """
+    sizes = [os.stat(path).st_size for path in paths]
+    file_size = 0x10 + sum(0x20 + size + padding(size) for size in sizes)
+
+    if output is not None:
+        output.write(pcm_header(file_size, len(paths)))
+        for path, name, size in zip(paths, names, sizes):
+            output.write(member_header(name, size))
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, output)
+                if f.tell() != size:
+                    raise Exception(f"File {path} changed while the PCM was being written!")
+            output.write(b"\x00" * padding(size))
+        return None
+
+    out = bytearray(file_size)
+    view = memoryview(out)
+    out[0:0x10] = pcm_header(file_size, len(paths))
+    pos = 0x10
+    for path, name, size in zip(paths, names, sizes):
+        out[pos:pos+0x20] = member_header(name, size)
+        pos += 0x20
+        with open(path, "rb") as f:
+            if f.readinto(view[pos:pos+size]) != size or f.read(1) != b"":
+                raise Exception(f"File {path} changed while the PCM was being written!")
+        pos += size + padding(size)
+    view.release()
+    return out
+
+def load(data):
+    """
+    Decompresses the contents of a PCM file. Uncompressed PCM files (like the ones made by `pcm create --no-compress`) are returned as-is.
+    """
+    if data[12:16] == b"LPCK":
+        return data
+    return compression.decompress(data)
+
 class PCM:
     def __init__(self, file, names=None):
         if names != None:
-            file = self.from_files(file, names)
+            with span("pcm.build") as s:
+                file = self.from_files(file, names)
+                s.add(len(file))
+        with span("pcm.parse", len(file)):
+            self.parse(file)
+
+    def parse(self, file):
         h_size = int.from_bytes(file[:4], "little")
         self.header = {
             "header_size": h_size,
@@ -69,62 +157,31 @@ class PCM:
             "num_files": len(files),
             "magic": b"LPCK"
         }
-        body = b''
-        c = 0
-        for file in files:
-            name = names[c]
-            if len(name) > 16:
-                raise Exception("File names longer than 16 characters (including extension) are not supported.")
-            padding = 16 - (len(file)%16)
-            if padding == 16:
-                padding = 0
-            header = {
-                "header_size": 0x20,
-                "file_size": 0x20 + len(file) + padding,
-                "reserved": 0,
-                "data_size": len(file),
-                "name": name.encode("ASCII") + b"\x00" * (16 - len(name))
-            }
-            body += header['header_size'].to_bytes(4, "little")
-            body += header['file_size'].to_bytes(4, "little")
-            body += header['reserved'].to_bytes(4, "little")
-            body += header['data_size'].to_bytes(4, "little")
-            body += header['name']
-            body += file + b"\x00" * padding
-            c += 1
-        head = b''
-        head += 0x10.to_bytes(4, "little")
-        head += (0x10 + len(body)).to_bytes(4, "little")
-        head += len(files).to_bytes(4, "little")
-        head += b"LPCK"
-        out = head + body
+        body = b''.join([member(name, file) for file, name in zip(files, names)])
+        out = pcm_header(0x10 + len(body), len(files)) + body
         return out
 
     def replace(self, name, content):
-        offset = self.offsets.get(name, None)
-        if offset == None:
-            raise Exception(f"File {name} doesn't exist inside PCM!")
-        end = offset + int.from_bytes(self.file[offset+4:offset+8], "little")
-        
-        file = b""
-        padding = 16 - (len(content)%16)
-        if padding == 16:
-            padding = 0
-        header = {
-            "header_size": 0x20,
-            "file_size": 0x20 + len(content) + padding,
-            "reserved": 0,
-            "data_size": len(content),
-            "name": name.encode("ASCII") + b"\x00" * (16 - len(name))
-        }
-        file += header['header_size'].to_bytes(4, "little")
-        file += header['file_size'].to_bytes(4, "little")
-        file += header['reserved'].to_bytes(4, "little")
-        file += header['data_size'].to_bytes(4, "little")
-        file += header['name']
-        file += content + b"\x00" * padding
-
-        self.file = self.file[:offset] + file + self.file[end:]
+        self.replace_many({name: content})
+
+    def replace_many(self, files):
+        """
+        Replaces several files at once (`files` maps each file name to its new contents), rebuilding the PCM only once.
+        """
+        for name in files:
+            if name not in self.offsets:
+                raise Exception(f"File {name} doesn't exist inside PCM!")
+
+        with span("pcm.replace", sum(len(content) for content in files.values())):
+            # Everything between the replaced files is copied over in one go
+            out = []
+            pos = 0
+            for offset, name in sorted((self.offsets[name], name) for name in files):
+                out.append(self.file[pos:offset])
+                out.append(member(name, files[name]))
+                pos = offset + int.from_bytes(self.file[offset+4:offset+8], "little")
+            out.append(self.file[pos:])
+            self.file = b"".join(out)
         filelen = len(self.file)
         self.file = self.file[:4] + filelen.to_bytes(4, "little") + self.file[8:]
         self.header['file_size'] = filelen
@@ -141,15 +198,16 @@ class PCM:
 @click.argument("output")
 @click.option("--file", "-f", metavar="FILENAME", multiple=True, help="If used, extracts only the file(s) specified. Can be used multiple times, one per file.")
 def extract(input, output, file):
-    input = open(input, "rb").read()
+    from project import open_file
+
+    project, name = open_file(input)
+    pcm = project.pcm(name)
     try:
         os.mkdir(output)
     except FileExistsError:
         #raise Exception(f"Directory {output} already exists! Delete it, then try again.")
         pass
 
-    input = lz10.decompress(input)
-    pcm = PCM(input)
     for f in pcm.offsets:
         if file != () and f not in file:
             continue
@@ -164,20 +222,22 @@ def extract(input, output, file):
             )
 @click.argument("input")
 @click.argument("output")
-def create(input, output):
+@click.option("--no-compress", is_flag=True, help="Don't compress the PCM file, which lets it be written straight to disk as the files are read.")
+def create(input, output, no_compress=False):
     if not os.path.isdir(input):
         raise Exception("Directory does not exist!")
+
+    names = [e.name for e in os.scandir(input) if e.is_file()]
+    paths = [f"{input}/{f}" for f in names]
     output = open(output, "wb")
-    
-    files = []
-    names = []
-    for f in list(os.walk(input))[0][2]:
-        names.append(f)
-        files.append(open(f"{input}/{f}", "rb").read())
-    pcm = PCM(files, names)
-
-    out = lz10.compress(pcm.file)
-    output.write(out)
+    if no_compress:
+        with span("pcm.build"):
+            pack(paths, names, output)
+    else:
+        with span("pcm.build") as s:
+            out = pack(paths, names)
+            s.add(len(out))
+        output.write(compression.compress(out))
     output.close()
 
 @cli.command(
@@ -189,17 +249,119 @@ def create(input, output):
 @click.argument("in_dir")#, help="The directory from which to get the replaced files.")
 @click.argument("output")#, help="Location for the output PCM file.")
 def replace(in_file, in_dir, output):
-    in_file = open(in_file, "rb").read()
+    from project import open_file
+
     if not os.path.isdir(in_dir):
         raise Exception("Directory does not exist!")
+    project, name = open_file(in_file)
+    # The cached PCM can't be changed, so the replacing is done on a copy
+    pcm = PCM(project.pcm(name).file)
     output = open(output, "wb")
 
-    in_file = lz10.decompress(in_file)
-    pcm = PCM(in_file)
+    pcm.replace_many({e.name: open(e.path, "rb").read() for e in os.scandir(in_dir) if e.is_file()})
 
-    for f in list(os.walk(in_dir))[0][2]:
-        pcm.replace(f, open(f"{in_dir}/{f}", "rb").read())
-        
-    out = lz10.compress(pcm.file)
+    out = compression.compress(pcm.file)
     output.write(out)
-    output.close()
\ No newline at end of file
+    output.close()
+
+def text_key(name):
+    """
+    Splits the name of a puzzle text file into its puzzle and field (e.g. "h_12_1.txt" -> (12, "h_1")).
+    Returns (None, name) for files that don't follow that naming.
+    """
+    match = re.fullmatch(r"([a-z]+)_(\d+)(?:_(\d+))?\.txt", name)
+    if match is None:
+        return None, name
+    field, puzzle, num = match.groups()
+    if num is not None:
+        field = f"{field}_{num}"
+    return int(puzzle), field
+
+def find_pcms(input):
+    """
+    Finds every PCM file inside a directory (and its subdirectories), as (language, path relative to the directory) pairs.
+    The language is the name of the subdirectory the PCM is in ("" if it's directly inside the input directory).
+    """
+    pcms = []
+    for dirpath, dirnames, filenames in os.walk(input):
+        dirnames.sort()
+        lang = os.path.relpath(dirpath, input).replace("\\", "/")
+        if lang == ".":
+            lang = ""
+        for f in sorted(filenames):
+            if f.lower().endswith(".pcm"):
+                pcms.append((lang, f"{lang}/{f}" if lang else f))
+    return pcms
+
+@cli.command(
+                name = "text-export",
+                no_args_is_help = True,
+                options_metavar = "[options]"
+            )
+@click.argument("input")
+@click.argument("output")
+@click.option("--encoding", "-e", default="cp1252", help="Text encoding of the game's text files (cp1252 by default; use shift_jis for Japanese ROMs).")
+def text_export(input, output, encoding):
+    """
+    Exports the text files inside every PCM in the directory INPUT (e.g. the qtext folder, with one subdirectory per language) into a single catalog.
+
+    OUTPUT is a JSONL file with one line per text file, with the keys "lang", "pcm", "file", "puzzle", "field" and "text".
+    Files that can't be decoded with the given encoding are stored as hex in "hex" instead of "text".
+    """
+    from project import Project
+
+    project = Project(input)
+    with open(output, "w", encoding="utf-8") as out:
+        for lang, path in find_pcms(input):
+            pcm = project.pcm(path)
+            for name in pcm.offsets:
+                puzzle, field = text_key(name)
+                row = {"lang": lang, "pcm": path, "file": name, "puzzle": puzzle, "field": field}
+                try:
+                    row["text"] = pcm[name].decode(encoding)
+                except UnicodeDecodeError:
+                    row["hex"] = pcm[name].hex()
+                out.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+@cli.command(
+                name = "text-import",
+                no_args_is_help = True,
+                options_metavar = "[options]"
+            )
+@click.argument("catalog")
+@click.argument("input")
+@click.argument("output")
+@click.option("--encoding", "-e", default="cp1252", help="Text encoding of the game's text files (cp1252 by default; use shift_jis for Japanese ROMs).")
+def text_import(catalog, input, output, encoding):
+    """
+    Imports a catalog made by `pcm text-export` back into the PCM files.
+
+    INPUT is the directory the catalog was exported from, and OUTPUT the directory the new PCM files are written to (with the same layout).
+    OUTPUT may be the same as INPUT. Every PCM is rebuilt and compressed once, with all of its files replaced at the same time.
+    PCMs where nothing changed are copied as-is.
+    """
+    changes = {} # PCM path -> {file name: contents}
+    with open(catalog, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if "text" in row:
+                content = row["text"].encode(encoding)
+            else:
+                content = bytes.fromhex(row["hex"])
+            changes.setdefault(row["pcm"], {})[row["file"]] = content
+
+    for path, files in changes.items():
+        original = open(f"{input}/{path}", "rb").read()
+        pcm = PCM(load(original))
+        for name in files:
+            if name not in pcm.offsets:
+                raise Exception(f"File {name} doesn't exist inside PCM!")
+        files = {name: content for name, content in files.items() if pcm[name] != content}
+        if files:
+            pcm.replace_many(files)
+            original = compression.compress(pcm.file)
+        os.makedirs(os.path.dirname(f"{output}/{path}"), exist_ok=True)
+        with open(f"{output}/{path}", "wb") as out:
+            out.write(original)
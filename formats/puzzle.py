@@ -1,35 +1,38 @@
 import click
-import json
 import os
 
 from formats import ndsrom
-
-dir_path = "/".join(os.path.dirname(os.path.realpath(__file__).replace("\\", "/")).split("/")[:-1])
-puzzles = json.load(open(f"{dir_path}/data/puzzles.json", encoding="utf-8"))
+from project import Project
+from timings import span
+from utils import load_data
 
 #@click.group(help="Simplify puzzle editing: extract or import the files related to a certain puzzle.",options_metavar='')
 #def cli():
 #    pass
 
-def load_file(rom_, out_dir, file, og_path, out_path="."):
+def load_file(project, out_dir, file, og_path, out_path="."):
     print(f"Extracting {file}...")
-    contents = rom_.getFileByName(f"data/{og_path}/{file}")  #maybe "data" is not an essential part?
-    f = open(f"{out_dir}/{out_path}/{file}", "wb")
-    f.write(contents)
-    f.close()
+    with span("puzzle.extract_file") as s:
+        contents = project.read(f"data/{og_path}/{file}")  #maybe "data" is not an essential part?
+        f = open(f"{out_dir}/{out_path}/{file}", "wb")
+        f.write(contents)
+        f.close()
+        s.add(len(contents))
 
 @click.command(
                 name="puzzle",
                 help="Extracts all the files related to a certain puzzle from the ROM into a specific directory",
                 no_args_is_help = True,
-                options_metavar = "[--lang]"
+                options_metavar = "[options]"
             )
 @click.argument("romfile")
 @click.argument("puzzle")
 @click.argument("out_dir")
 @click.option("--lang", is_flag=True, default = False, help = "Load the game titles in their original language.")
-def cli(romfile, puzzle, out_dir, lang):
-    romfile, id, title = ndsrom.load(romfile, lang)
+@click.option("--assume-yes", "-y", is_flag=True, help = "Don't ask for confirmation when loading a game that hasn't been tested with Flora.")
+def cli(romfile, puzzle, out_dir, lang, assume_yes = False):
+    romfile, id, title = ndsrom.load(romfile, lang, assume_yes=assume_yes)
+    project = Project(romfile)
     try:
         os.mkdir(out_dir)
     except FileExistsError:
@@ -42,7 +45,7 @@ def cli(romfile, puzzle, out_dir, lang):
 
         readme = open(f"{out_dir}/readme.txt", "a", encoding="utf-8")
 
-        puzzle = puzzles["A5F"].get(puzzle)
+        puzzle = load_data("puzzles")["A5F"].get(puzzle)
         if puzzle == None:
             raise Exception("Puzzle provided is not valid! See the readme for a list of valid puzzles.")
 
@@ -72,31 +75,31 @@ def cli(romfile, puzzle, out_dir, lang):
             bga_lang = True
 
             try:
-                load_file(romfile, out_dir, f"q{puzzle}_bg.arc", "bg", "bg")
+                load_file(project, out_dir, f"q{puzzle}_bg.arc", "bg", "bg")
             except ValueError:
                 print(f"File q{puzzle}_bg.arc not found - to be looked in language folders")
             
             try:
-                load_file(romfile, out_dir, f"q{puzzle}a_bg.arc", "bg", "bg")
+                load_file(project, out_dir, f"q{puzzle}a_bg.arc", "bg", "bg")
             except ValueError:
                 print(f"File q{puzzle}a_bg.arc not found - to be looked in language folders")
 
             for lang in langs:
                 if bg_lang:
                     try:
-                        load_file(romfile, out_dir, f"{lang}/q{puzzle}_bg.arc", "bg", "bg")
+                        load_file(project, out_dir, f"{lang}/q{puzzle}_bg.arc", "bg", "bg")
                     except ValueError:
                         print(f"File q{puzzle}_bg.arc not found in language folders.")
                         bg_lang = False
                 if bga_lang:
                     try:
-                        load_file(romfile, out_dir, f"{lang}/q{puzzle}a_bg.arc", "bg", "bg")
+                        load_file(project, out_dir, f"{lang}/q{puzzle}a_bg.arc", "bg", "bg")
                     except ValueError:
                         print(f"File q{puzzle}a_bg.arc not found in language folders.")
                         bga_lang = False
-                load_file(romfile, out_dir, f"{lang}/{pcm_file}", "qtext", "qtext")
-                load_file(romfile, out_dir, f"{lang}/qscript.gds", "script/qinfo", "script")
-                load_file(romfile, out_dir, f"{lang}/qtitle.gds", "script/puzzletitle", "script")
+                load_file(project, out_dir, f"{lang}/{pcm_file}", "qtext", "qtext")
+                load_file(project, out_dir, f"{lang}/qscript.gds", "script/qinfo", "script")
+                load_file(project, out_dir, f"{lang}/qtitle.gds", "script/puzzletitle", "script")
             
             readme.write(
 f'''The files you want from the PCM file are:
@@ -114,64 +117,64 @@ f'''The files you want from the PCM file are:
             if puzzle == 163:
                 raise Exception("Puzzle not available in US version!")
             try:
-                load_file(romfile, out_dir, f"q{puzzle}_bg.arc", "bg", "bg")
+                load_file(project, out_dir, f"q{puzzle}_bg.arc", "bg", "bg")
             except ValueError:
                 print(f"File q{puzzle}_bg.arc not found")
             try:
-                load_file(romfile, out_dir, f"q{puzzle}a_bg.arc", "bg", "bg")
+                load_file(project, out_dir, f"q{puzzle}a_bg.arc", "bg", "bg")
             except ValueError:
                 print(f"File q{puzzle}a_bg.arc not found")
-            load_file(romfile, out_dir, f"t_{puzzle}.txt", "qtext/en", "qtext")
-            load_file(romfile, out_dir, f"q_{puzzle}.txt", "qtext/en", "qtext")
-            load_file(romfile, out_dir, f"h_{puzzle}_1.txt", "qtext/en", "qtext")
-            load_file(romfile, out_dir, f"h_{puzzle}_2.txt", "qtext/en", "qtext")
-            load_file(romfile, out_dir, f"h_{puzzle}_3.txt", "qtext/en", "qtext")
-            load_file(romfile, out_dir, f"f_{puzzle}.txt", "qtext/en", "qtext")
-            load_file(romfile, out_dir, f"c_{puzzle}.txt", "qtext/en", "qtext")
-            load_file(romfile, out_dir, "qscript.gds", "script/qinfo/en", "script")
-            load_file(romfile, out_dir, "qtitle.gds", "script/puzzletitle/en", "script")
+            load_file(project, out_dir, f"t_{puzzle}.txt", "qtext/en", "qtext")
+            load_file(project, out_dir, f"q_{puzzle}.txt", "qtext/en", "qtext")
+            load_file(project, out_dir, f"h_{puzzle}_1.txt", "qtext/en", "qtext")
+            load_file(project, out_dir, f"h_{puzzle}_2.txt", "qtext/en", "qtext")
+            load_file(project, out_dir, f"h_{puzzle}_3.txt", "qtext/en", "qtext")
+            load_file(project, out_dir, f"f_{puzzle}.txt", "qtext/en", "qtext")
+            load_file(project, out_dir, f"c_{puzzle}.txt", "qtext/en", "qtext")
+            load_file(project, out_dir, "qscript.gds", "script/qinfo/en", "script")
+            load_file(project, out_dir, "qtitle.gds", "script/puzzletitle/en", "script")
         
         elif id.endswith("J"):
             if puzzle == 163:
                 raise Exception("Puzzle not available on JP version!")
             try:
-                load_file(romfile, out_dir, f"q{puzzle}_bg.arc", "bg", "bg")
+                load_file(project, out_dir, f"q{puzzle}_bg.arc", "bg", "bg")
             except ValueError:
                 print(f"File q{puzzle}_bg.arc not found")
             try:
-                load_file(romfile, out_dir, f"q{puzzle}a_bg.arc", "bg", "bg")
+                load_file(project, out_dir, f"q{puzzle}a_bg.arc", "bg", "bg")
             except ValueError:
                 print(f"File q{puzzle}a_bg.arc not found")
-            load_file(romfile, out_dir, f"t_{puzzle}.txt", "qtext", "qtext")
-            load_file(romfile, out_dir, f"q_{puzzle}.txt", "qtext", "qtext")
-            load_file(romfile, out_dir, f"h_{puzzle}_1.txt", "qtext", "qtext")
-            load_file(romfile, out_dir, f"h_{puzzle}_2.txt", "qtext", "qtext")
-            load_file(romfile, out_dir, f"h_{puzzle}_3.txt", "qtext", "qtext")
-            load_file(romfile, out_dir, f"f_{puzzle}.txt", "qtext", "qtext")
-            load_file(romfile, out_dir, f"c_{puzzle}.txt", "qtext", "qtext")
-            load_file(romfile, out_dir, "qscript.gds", "script/qinfo", "script")
-            load_file(romfile, out_dir, "qtitle.gds", "script/puzzletitle", "script")
+            load_file(project, out_dir, f"t_{puzzle}.txt", "qtext", "qtext")
+            load_file(project, out_dir, f"q_{puzzle}.txt", "qtext", "qtext")
+            load_file(project, out_dir, f"h_{puzzle}_1.txt", "qtext", "qtext")
+            load_file(project, out_dir, f"h_{puzzle}_2.txt", "qtext", "qtext")
+            load_file(project, out_dir, f"h_{puzzle}_3.txt", "qtext", "qtext")
+            load_file(project, out_dir, f"f_{puzzle}.txt", "qtext", "qtext")
+            load_file(project, out_dir, f"c_{puzzle}.txt", "qtext", "qtext")
+            load_file(project, out_dir, "qscript.gds", "script/qinfo", "script")
+            load_file(project, out_dir, "qtitle.gds", "script/puzzletitle", "script")
         
         elif id.endswith("K"):
             try:
-                load_file(romfile, out_dir, f"q{puzzle}_bg.arc", "bg", "bg")
+                load_file(project, out_dir, f"q{puzzle}_bg.arc", "bg", "bg")
             except ValueError:
                 print(f"File q{puzzle}_bg.arc not found - looking in /ko folder")
                 try:
-                    load_file(romfile, out_dir, f"q{puzzle}_bg.arc", "bg/ko", "bg")
+                    load_file(project, out_dir, f"q{puzzle}_bg.arc", "bg/ko", "bg")
                 except ValueError:
                     print(f"File q{puzzle}_bg.arc not found in /ko folder")
             try:
-                load_file(romfile, out_dir, f"q{puzzle}a_bg.arc", "bg", "bg")
+                load_file(project, out_dir, f"q{puzzle}a_bg.arc", "bg", "bg")
             except ValueError:
                 print(f"File q{puzzle}a_bg.arc not found - looking in /ko folder")
                 try:
-                    load_file(romfile, out_dir, f"q{puzzle}a_bg.arc", "bg/ko", "bg")
+                    load_file(project, out_dir, f"q{puzzle}a_bg.arc", "bg/ko", "bg")
                 except ValueError:
                     print(f"File q{puzzle}a_bg.arc not found in /ko folder")
-            load_file(romfile, out_dir, pcm_file, "qtext/ko", "qtext")
-            load_file(romfile, out_dir, "qscript.gds", "script/qinfo/ko", "script")
-            load_file(romfile, out_dir, "qtitle.gds", "script/puzzletitle/ko", "script")
+            load_file(project, out_dir, pcm_file, "qtext/ko", "qtext")
+            load_file(project, out_dir, "qscript.gds", "script/qinfo/ko", "script")
+            load_file(project, out_dir, "qtitle.gds", "script/puzzletitle/ko", "script")
 
             readme.write(
 f'''The files you want from the PCM file are:
@@ -196,8 +199,8 @@ Inside the qscript.gds script, look for the line that starts with: 0xdc {puzzle}
         readme.close()
 
         #extract all files that don't depend on language (the grand total of 3 :P)
-        load_file(romfile, out_dir, f"jiten_q{puzzle}.arc", "bg", "bg")
-        load_file(romfile, out_dir, f"q{puzzle}_param.gds", "script/qscript", "script")
-        load_file(romfile, out_dir, "pscript.gds", "script/pcarot", "script")
+        load_file(project, out_dir, f"jiten_q{puzzle}.arc", "bg", "bg")
+        load_file(project, out_dir, f"q{puzzle}_param.gds", "script/qscript", "script")
+        load_file(project, out_dir, "pscript.gds", "script/pcarot", "script")
 
         print("\nDone!")
\ No newline at end of file
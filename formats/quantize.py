@@ -0,0 +1,129 @@
+'''Color quantization of truecolor images into the indexed images used by the game'''
+import heapq
+from collections import Counter
+
+from PIL import Image
+
+from . import palette, tiles
+
+def _channels(color):
+    return (color & 0x1f, color >> 5 & 0x1f, color >> 10 & 0x1f)
+
+class _Box:
+    """
+    A set of colors (with their pixel counts) for median cut.
+    Its error (sum of the squared distances to its mean, for the worst channel) is computed once, and decides which box gets split next.
+    """
+    def __init__(self, colors):
+        self.colors = colors
+        self.count = sum(n for _, n in colors)
+        self.mean = [0, 0, 0]
+        self.error = 0
+        self.channel = 0
+        if len(colors) < 2:
+            self.mean = list(_channels(colors[0][0]))
+            return
+        for ch in range(3):
+            total = 0
+            total_sq = 0
+            for color, n in colors:
+                v = color >> 5 * ch & 0x1f
+                total += v * n
+                total_sq += v * v * n
+            self.mean[ch] = round(total / self.count)
+            error = total_sq - total * total / self.count
+            if error > self.error:
+                self.error = error
+                self.channel = ch
+
+    def split(self):
+        shift = 5 * self.channel
+        colors = sorted(self.colors, key=lambda c: c[0] >> shift & 0x1f)
+        # Split at the weighted median, so that both halves have around the same amount of pixels
+        half = self.count / 2
+        seen = 0
+        for i, (_, n) in enumerate(colors):
+            seen += n
+            if seen >= half:
+                break
+        i = min(max(i, 0), len(colors) - 2)
+        return _Box(colors[:i+1]), _Box(colors[i+1:])
+
+def median_cut(counts, num_colors = 256):
+    """
+    Reduces the BGR555 colors in `counts` (a dict of color -> amount of pixels) to at most `num_colors` colors.
+
+    Returns the new palette (as a list of BGR555 colors) and a dict mapping every original color to its index in the palette.
+    """
+    if len(counts) <= num_colors:
+        colors = sorted(counts)
+        return colors, {color: i for i, color in enumerate(colors)}
+
+    # heapq is a min-heap, so the errors are negated. The counter avoids comparing boxes with the same error
+    boxes = [(0, 0, _Box(list(counts.items())))]
+    c = 1
+    while len(boxes) < num_colors:
+        error, _, box = heapq.heappop(boxes)
+        if box.error == 0:
+            heapq.heappush(boxes, (error, c, box))
+            break
+        for half in box.split():
+            heapq.heappush(boxes, (-half.error, c, half))
+            c += 1
+
+    colors = []
+    index = {}
+    for i, (_, _, box) in enumerate(boxes):
+        r, g, b = box.mean
+        colors.append(r | g << 5 | b << 10)
+        for color, _ in box.colors:
+            index[color] = i
+    return colors, index
+
+def quantize(img, num_colors = 256):
+    """
+    Converts a PIL image of any mode into an indexed (mode "P") image with at most `num_colors` colors.
+
+    Since the game only keeps 5 bits per channel, colors are reduced to BGR555 first, and only the unique colors that are left are quantized.
+    """
+    width, height = img.size
+    pixels = palette.to_colors(img.convert("RGB").tobytes())
+    colors, index = median_cut(Counter(pixels), num_colors)
+
+    out = Image.frombytes("P", (width, height), bytes(map(index.__getitem__, pixels)))
+    pal = bytearray()
+    for color in colors:
+        pal += bytes(v << 3 for v in _channels(color))
+    out.putpalette(pal)
+    return out
+
+def merge_similar_tiles(img, shift = 1):
+    """
+    Lowers the number of unique tiles of an indexed image, by replacing every tile that looks almost the same as a previous one with that tile.
+
+    Two tiles are considered almost the same when all of their pixels are equal after dropping the lowest `shift` bits of each 5-bit channel.
+    """
+    width, height = img.size
+    data = bytearray(img.tobytes())
+    pal = palette.to_colors(img.getpalette())
+    mask = (0x1f >> shift << shift) * 0x421 # same mask for all 3 channels
+    # Every palette index is mapped to the first palette index with the same coarse color
+    first = {}
+    coarse = bytearray(256)
+    for i, color in enumerate(pal):
+        coarse[i] = first.setdefault(color & mask, i)
+    coarse = bytes(coarse)
+
+    seen = {}
+    for y in range(height // 8):
+        for x in range(width // 8):
+            tile = tiles.get_tile(data, width, x, y)
+            key = tile.translate(coarse)
+            if key not in seen:
+                seen[key] = tile
+            else:
+                tiles.put_tile(data, width, x, y, seen[key])
+
+    out = Image.frombytes("P", (width, height), bytes(data))
+    out.putpalette(img.getpalette())
+    return out
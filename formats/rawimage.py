@@ -0,0 +1,145 @@
+'''Uncompressed outputs for indexed images (Flora's raw format and NumPy's .npy), and zero-copy readers for them'''
+import ast
+import mmap
+
+from PIL import Image
+
+# Raw format: the magic, then width, height and number of colors (u16 each, little endian), 2 reserved bytes,
+# the palette (3 bytes per color, RGB888), and the pixels (1 byte per pixel, one row after the other)
+RAW_MAGIC = b"FLRI"
+RAW_HEADER_SIZE = 12
+
+NPY_MAGIC = b"\x93NUMPY"
+
+class RawImage:
+    """
+    An indexed image read from a raw or .npy file. `palette` and `pixels` are memoryviews into the (memory-mapped) file, so nothing is copied
+    until they're used. Call `close()` (or use it as a context manager) once done with them.
+    """
+    def __init__(self, width, height, palette, pixels, maps = ()):
+        self.width = width
+        self.height = height
+        self.palette = palette
+        self.pixels = pixels
+        self._maps = maps # (mmap, memoryview of the whole mmap) pairs
+
+    def to_image(self):
+        """
+        Returns the image as an indexed (mode "P") PIL image. The pixels are copied, so the image can still be used after `close()`.
+        """
+        img = Image.frombytes("P", (self.width, self.height), self.pixels)
+        img.putpalette(bytes(self.palette))
+        return img
+
+    def close(self):
+        # Every view of an mmap has to be released before it can be closed
+        self.palette.release()
+        self.pixels.release()
+        for data, view in self._maps:
+            view.release()
+            data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def _map(path):
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return data, memoryview(data)
+
+def write_raw(f, img):
+    """
+    Writes an indexed PIL image to an open file in the raw format.
+    """
+    palette = bytes(img.getpalette() or b"")
+    f.write(RAW_MAGIC)
+    f.write(img.size[0].to_bytes(2, "little"))
+    f.write(img.size[1].to_bytes(2, "little"))
+    f.write((len(palette) // 3).to_bytes(2, "little"))
+    f.write(b"\x00\x00")
+    f.write(palette)
+    f.write(img.tobytes())
+
+def read_raw(path):
+    """
+    Memory-maps a file written by `write_raw`, returning a `RawImage`.
+    """
+    data, view = _map(path)
+    if data[:4] != RAW_MAGIC:
+        view.release()
+        data.close()
+        raise Exception("Not a valid raw image file!")
+    width = int.from_bytes(data[4:6], "little")
+    height = int.from_bytes(data[6:8], "little")
+    num_colors = int.from_bytes(data[8:10], "little")
+    pal_end = RAW_HEADER_SIZE + num_colors*3
+    return RawImage(width, height, view[RAW_HEADER_SIZE:pal_end], view[pal_end:pal_end + width*height], [(data, view)])
+
+def write_npy(f, data, shape):
+    """
+    Writes bytes to an open file as a .npy array of unsigned bytes with the given shape, so that NumPy can load it (no NumPy needed here).
+    """
+    header = repr({"descr": "|u1", "fortran_order": False, "shape": tuple(shape)}).encode("latin1")
+    # The header (including the magic, version and length) is padded with spaces to a multiple of 64 bytes, and ends with a newline
+    header += b" " * (-(len(header) + 11) % 64) + b"\n"
+    f.write(NPY_MAGIC + b"\x01\x00")
+    f.write(len(header).to_bytes(2, "little"))
+    f.write(header)
+    f.write(data)
+
+def read_npy(path):
+    """
+    Memory-maps a .npy file of unsigned bytes, returning its shape, a memoryview of its data, and the (mmap, memoryview) pair to close later.
+    """
+    data, view = _map(path)
+    if data[:6] != NPY_MAGIC:
+        view.release()
+        data.close()
+        raise Exception(f"{path} isn't a .npy file!")
+    if data[6] == 1:
+        header_len, start = int.from_bytes(data[8:10], "little"), 10
+    else:
+        header_len, start = int.from_bytes(data[8:12], "little"), 12
+    header = ast.literal_eval(data[start:start+header_len].decode("latin1"))
+    if header["descr"] not in ("|u1", "<u1", "u1") or header["fortran_order"]:
+        view.release()
+        data.close()
+        raise Exception(f"{path} isn't an array of unsigned bytes!")
+    return header["shape"], view[start+header_len:], (data, view)
+
+def palette_path(path):
+    """
+    The path of the palette that goes with the pixels in the .npy file `path` (e.g. "q1_bg.npy" -> "q1_bg.pal.npy").
+    """
+    if path.lower().endswith(".npy"):
+        path = path[:-4]
+    return path + ".pal.npy"
+
+def write_npy_image(path, img):
+    """
+    Writes an indexed PIL image as two .npy files: the pixels (height x width) in `path`, and the palette (colors x 3) in `palette_path(path)`.
+    """
+    with open(path, "wb") as f:
+        write_npy(f, img.tobytes(), (img.size[1], img.size[0]))
+    palette = bytes(img.getpalette() or b"")
+    with open(palette_path(path), "wb") as f:
+        write_npy(f, palette, (len(palette) // 3, 3))
+
+def read_npy_image(path):
+    """
+    Memory-maps the two .npy files written by `write_npy_image`, returning a `RawImage`.
+    """
+    (height, width), pixels, pixel_map = read_npy(path)
+    _, palette, palette_map = read_npy(palette_path(path))
+    return RawImage(width, height, palette, pixels, [pixel_map, palette_map])
+
+def open_image(path):
+    """
+    Opens a raw (.raw) or .npy image as a `RawImage`, depending on its extension.
+    """
+    if path.lower().endswith(".npy"):
+        return read_npy_image(path)
+    return read_raw(path)
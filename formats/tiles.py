@@ -0,0 +1,55 @@
+'''Conversion between 8x8 tiles and linear pixel data, shared by the image formats'''
+
+# Splits each 4bpp byte into its low (first) and high (second) pixel
+_low = bytes(c & 0xf for c in range(256))
+_high = bytes(c >> 4 for c in range(256))
+
+def unpack_4bpp(data):
+    """
+    Converts 4bpp pixel data (two pixels per byte, low nibble first) into one byte per pixel.
+    """
+    data = bytes(data)
+    out = bytearray(len(data) * 2)
+    out[0::2] = data.translate(_low)
+    out[1::2] = data.translate(_high)
+    return bytes(out)
+
+def pack_4bpp(data):
+    """
+    Converts one byte per pixel (values below 16) into 4bpp pixel data (two pixels per byte, low nibble first).
+    """
+    data = bytes(data)
+    return bytes(low | high << 4 for low, high in zip(data[0::2], data[1::2]))
+
+def put_tile(out, width, x, y, tile, flip_x = False, flip_y = False):
+    """
+    Writes an 8x8 tile (64 bytes, one per pixel) into `out`, the linear pixel data of an image `width` pixels wide, at tile position (x, y).
+    """
+    pos = y * 8 * width + x * 8
+    for row in (range(7, -1, -1) if flip_y else range(8)):
+        line = tile[row*8:row*8+8]
+        out[pos:pos+8] = line[::-1] if flip_x else line
+        pos += width
+
+def get_tile(data, width, x, y):
+    """
+    Reads the 8x8 tile at tile position (x, y) from `data`, the linear pixel data of an image `width` pixels wide.
+    """
+    pos = y * 8 * width + x * 8
+    return b"".join([data[pos + row*width:pos + row*width + 8] for row in range(8)])
+
+def untile(data, width, height):
+    """
+    Converts pixel data stored as 8x8 tiles (left to right, then top to bottom) into the linear pixel data of a `width`x`height` image.
+    """
+    out = bytearray(width * height)
+    tiles_x = width // 8
+    for t in range(tiles_x * (height // 8)):
+        put_tile(out, width, t % tiles_x, t // tiles_x, data[t*64:t*64+64])
+    return bytes(out)
+
+def tile(data, width, height):
+    """
+    Converts the linear pixel data of a `width`x`height` image into 8x8 tiles (left to right, then top to bottom).
+    """
+    return b"".join([get_tile(data, width, x, y) for y in range(height // 8) for x in range(width // 8)])
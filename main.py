@@ -1,19 +1,58 @@
 import click
 
-import formats
+from utils import LazyGroup
 from version import v
 
 CONTEXT_SETTINGS = dict(help_option_names = ['--help', '-h', '-?'])
 
-@click.group(name="flora", context_settings=CONTEXT_SETTINGS)
+# Subcommands are only imported when used, so that e.g. `flora --help` doesn't have to load Pillow, ndspy or the data tables
+LAZY_COMMANDS = {
+    "gds": ("formats.gds:cli", "Script-like format, also used to store puzzle parameters."),
+    "bg": ("formats.bg:cli", "'Background' / texture format."),
+    "pcm": ("formats.pcm:cli", "Archive/pack format, used to store text files."),
+    "ani": ("formats.ani:cli", "Animated sprite format."),
+    "puzzle": ("formats.puzzle:cli", "Extracts all the files related to a certain puzzle from the ROM into a specific directory"),
+    "build": ("build:cli", "Builds a mod project from its manifest (flora.json by default)."),
+    "scan": ("scan:cli", "Lists every file in the ROM, with its format, compression, sizes and anything unusual about it."),
+    "diff": ("romdiff:cli", "Lists the files that differ between two ROMs, such as two regions or revisions of a game."),
+    "verify": ("verify:cli", "Checks whether a ROM is a clean dump, by comparing it with the fingerprints of known clean dumps."),
+    "serve": ("server:cli", "Runs a persistent Flora server, which keeps the format modules, data tables and recently loaded ROMs warm between commands."),
+}
+
+@click.group(name="flora", cls=LazyGroup, lazy_commands=LAZY_COMMANDS, context_settings=CONTEXT_SETTINGS)
 @click.version_option(v, '--version', '-v', prog_name="flora", message=f"Flora v{v} by patataofcourse")
-def cli():
-    pass
+@click.option("--timings", "show_timings", is_flag=True, help="Record the time spent (and bytes processed) in each stage of the command, and print a JSON summary to stderr.")
+@click.option("--timings-file", type=click.Path(dir_okay=False), default=None, metavar="FILE", help="Write the --timings summary to FILE instead of stderr.")
+@click.option("--profile", type=click.Path(dir_okay=False), default=None, metavar="FILE", help="Run the command under cProfile and save the profile to FILE (readable with pstats).")
+@click.pass_context
+def cli(ctx, show_timings = False, timings_file = None, profile = None):
+    if show_timings or timings_file is not None:
+        import json
+        import sys
+        import timings
+
+        def write_timings():
+            timings.stop()
+            summary = json.dumps(timings.summary(), indent=4)
+            if timings_file is None:
+                print(summary, file=sys.stderr)
+            else:
+                with open(timings_file, "w", encoding="utf-8") as f:
+                    f.write(summary)
+
+        timings.start()
+        ctx.call_on_close(write_timings)
+
+    if profile is not None:
+        import cProfile
+
+        def write_profile():
+            profiler.disable()
+            profiler.dump_stats(profile)
 
-cli.add_command(formats.gds.cli, "gds")
-cli.add_command(formats.bg.cli, "bg")
-cli.add_command(formats.pcm.cli, "pcm")
-cli.add_command(formats.puzzle.cli, "puzzle")
+        profiler = cProfile.Profile()
+        profiler.enable()
+        ctx.call_on_close(write_profile)
 
 if __name__ == "__main__":
-    cli() #TODO: managing exceptions
\ No newline at end of file
+    cli() #TODO: managing exceptions
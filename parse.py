@@ -1,31 +1,70 @@
 '''Some stuff used for parsing text'''
+import re
 
-def remove_strings(text): #wow i actually commented this very cool
-    #get the start and end of every string
-    quotepos = [] #here we'll store the index of every quote that's not been escaped
-    for quote in ("'", "\""):
-        allpos = [i for i in range(len(text)) if text.startswith(quote, i)] #gets all instances of each type of quotes
-        for index in allpos:
-            if text[index-1] != "\\":
-                quotepos.append(index) #only pass to quotepos the strings that weren't escaped
-    opened_quote = ""
-    quotes = []
-    for index in sorted(quotepos):
-        if opened_quote == "": #no open quotes
-            opened_quote = text[index]
-            quotes.append(index)
-        elif opened_quote == text[index]:       #current quote is the same as the open quote -> it closes, and
-            quotes[-1] = (quotes[-1], index)    #otherwise it just gets ignored and treated as any other character
-            opened_quote = ""
-    if opened_quote != "":
-        return None, None
-    #now, replace them with things that won't be screwed up by the rest of input_format
-    quotes.reverse() #this way the index numbers don't get fucked up
-    c = 1
-    quotetext = []
-    for quote in quotes:
-        quotetext = [text[quote[0]+1:quote[1]]] + quotetext
-        text = text[:quote[0]] + f'"{len(quotes)-c}"' + text[quote[1]+1:] #"0", "1", etc.
-        c += 1
-    outquotes = [i.replace("\\'", "'").replace('\\"', '"') for i in quotetext] #gets all instances of each type of quotes
-    return text, outquotes
\ No newline at end of file
+class GDAError (Exception):
+    def __init__(self, message, line, column):
+        self.line = line
+        self.column = column
+        super().__init__(f"GDA error at line {line}, column {column}: {message}")
+
+# A single regex with one group per token type, so that the whole text is scanned once
+_gda_token = re.compile(r'''
+      (?P<newline>\n)
+    | (?P<space>[ \t\r]+)
+    | (?P<comment>\#[^\n]*)
+    | (?P<string>"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    | (?P<hex>0x[0-9a-fA-F]+)
+    | (?P<int>[0-9]+)
+    | (?P<name>[A-Za-z_][A-Za-z0-9_-]*)
+    | (?P<error>.)
+''', re.VERBOSE)
+
+_escape = re.compile(r'''\\([\\'"])''')
+
+def tokenize_gda(text):
+    """
+    Splits a GDA script into tokens in a single pass, yielding (type, value, line, column) tuples.
+
+    The token types are:
+    - "name": a bare word, like a command name (value: the word)
+    - "hex": a hexadecimal number starting with 0x (value: the number)
+    - "int": a decimal number (value: the number)
+    - "string": a string between single or double quotes (value: the string). \\', \\" and \\\\ are unescaped,
+      any other backslash is kept as-is.
+    - "newline": the end of a line (value: None). Comments (from # to the end of the line) and whitespace are skipped.
+
+    Raises GDAError for anything else, or for two values that aren't separated by whitespace.
+    """
+    line = 1
+    line_start = 0
+    last_end = -1 # end of the last value token, to catch values that are stuck together
+    for match in _gda_token.finditer(text):
+        kind = match.lastgroup
+        if kind == "space" or kind == "comment":
+            continue
+        start = match.start()
+        column = start - line_start + 1
+        if kind == "newline":
+            yield ("newline", None, line, column)
+            line += 1
+            line_start = match.end()
+            continue
+        value = match.group()
+        if kind == "error":
+            if value in "'\"":
+                raise GDAError("Unterminated string", line, column)
+            raise GDAError(f"Invalid character {value!r}", line, column)
+        if last_end == start:
+            raise GDAError(f"Invalid GDA parameter: {value!r} isn't separated from the previous one", line, column)
+        last_end = match.end()
+
+        if kind == "string":
+            value = value[1:-1]
+            if "\\" in value:
+                value = _escape.sub(r"\1", value)
+        elif kind == "hex":
+            value = int(value[2:], 16)
+        elif kind == "int":
+            value = int(value)
+        yield (kind, value, line, column)
+    yield ("newline", None, line, len(text) - line_start + 1)
@@ -0,0 +1,228 @@
+import collections
+import copy
+import os
+
+from ndspy import rom
+
+from formats import ndsrom
+from timings import span
+
+DEFAULT_CACHE_SIZE = 256 << 20 # bytes
+
+class LRUCache:
+    """
+    Keeps the most recently used objects, up to a total size (in bytes) of `max_size`.
+    Sizes are given by whoever adds an object, and are meant as an estimate of the memory it uses.
+    """
+    def __init__(self, max_size = DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.items = collections.OrderedDict() # key -> (object, size)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        """
+        Returns the object for `key`, calling `load()` to make it (and then keeping it) if it isn't cached.
+        `load` must return an (object, size) pair.
+        """
+        if key in self.items:
+            self.hits += 1
+            self.items.move_to_end(key)
+            return self.items[key][0]
+        self.misses += 1
+        obj, size = load()
+        if size <= self.max_size:
+            self.items[key] = (obj, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, old_size) = self.items.popitem(last=False)
+                self.size -= old_size
+        return obj
+
+    def discard(self, match):
+        """
+        Removes every object whose key matches (`match(key)` returns True).
+        """
+        for key in [key for key in self.items if match(key)]:
+            self.size -= self.items.pop(key)[1]
+
+    def clear(self):
+        self.items.clear()
+        self.size = 0
+
+class Project:
+    """
+    A ROM (or a directory with files extracted from one), for using Flora as a library.
+
+    Files are referred to by their path inside the ROM (e.g. "data/bg/q1_bg.arc"), or relative to the directory.
+    Decoded files (GDS scripts, PCM archives, BG and ANI images) are kept in an LRU cache of up to `cache_size` bytes,
+    so asking for the same file again doesn't read or decompress it again. Cached objects are shared, so they shouldn't be modified
+    (use `write` to change a file).
+
+    A ROM opened from a path is shared with the rest of the process (see `ndsrom.open_rom`), so it's only copied when a file is written:
+    changes never show up in other projects. A `NintendoDSRom` passed in is changed in place.
+
+    Directory projects can share an LRUCache (`cache`): their cached files are keyed by their full path, size and modification time,
+    so a file that changes on disk is decoded again.
+    """
+    def __init__(self, source, cache_size = DEFAULT_CACHE_SIZE, cache = None):
+        self.rom = None
+        self.root = None
+        self.shared_rom = False
+        if isinstance(source, rom.NintendoDSRom):
+            self.rom = source
+        elif os.path.isdir(source):
+            self.root = source
+        else:
+            self.rom = ndsrom.open_rom(source)
+            self.shared_rom = True
+        self.cache = cache if cache is not None else LRUCache(cache_size)
+
+    def _name(self, path):
+        # What identifies a file in the cache keys
+        if self.rom is not None:
+            return path
+        return os.path.realpath(os.path.join(self.root, path))
+
+    def _key(self, kind, path, *extra):
+        if self.rom is not None:
+            return (kind, path) + extra
+        name = self._name(path)
+        try:
+            stat = os.stat(name)
+        except FileNotFoundError:
+            raise ValueError(f'Cannot find file "{path}"')
+        return (kind, name, stat.st_mtime_ns, stat.st_size) + extra
+
+    def read(self, path):
+        """
+        Returns the raw contents of a file. Raises ValueError if it doesn't exist (like ndspy).
+        """
+        if self.rom is not None:
+            return self.rom.getFileByName(path)
+        try:
+            with open(os.path.join(self.root, path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ValueError(f'Cannot find file "{path}"')
+
+    def exists(self, path):
+        if self.rom is not None:
+            return self.rom.filenames.idOf(path) is not None
+        return os.path.isfile(os.path.join(self.root, path))
+
+    def files(self, folder = ""):
+        """
+        Lists the paths of every file inside a folder (and its subfolders), or of the whole project.
+        """
+        folder = folder.strip("/")
+        if self.rom is not None:
+            out = []
+            def walk(f, prefix):
+                out.extend(prefix + name for name in f.files)
+                for name, subfolder in f.folders:
+                    walk(subfolder, f"{prefix}{name}/")
+            start = self.rom.filenames.subfolder(folder) if folder else self.rom.filenames
+            if start is not None:
+                walk(start, f"{folder}/" if folder else "")
+            return out
+        out = []
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self.root, folder)):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, self.root).replace("\\", "/")
+            out.extend(name if rel == "." else f"{rel}/{name}" for name in sorted(filenames))
+        return out
+
+    def write(self, path, data):
+        """
+        Replaces the contents of a file (on disk for directories, or in memory for ROMs; see `save`), and forgets its decoded versions.
+        """
+        if self.rom is not None:
+            fid = self.rom.filenames.idOf(path)
+            if fid is None:
+                raise ValueError(f'Cannot find file ID of "{path}"')
+            if self.shared_rom:
+                # Only the list of files is changed, so the rest of the ROM can still be shared
+                self.rom = copy.copy(self.rom)
+                self.rom.files = list(self.rom.files)
+                self.shared_rom = False
+            self.rom.files[fid] = bytes(data)
+        else:
+            full = os.path.join(self.root, path)
+            os.makedirs(os.path.dirname(full) or ".", exist_ok=True)
+            with open(full, "wb") as f:
+                f.write(data)
+        name = self._name(path)
+        self.cache.discard(lambda key: key[1] == name)
+
+    def save(self, path):
+        """
+        Saves a ROM project (with the files changed by `write`) to a new ROM file.
+        """
+        if self.rom is None:
+            raise Exception("Only ROM projects can be saved; files in a directory are written as they change.")
+        with span("ndsrom.save"):
+            self.rom.saveToFile(path)
+
+    def gds(self, path):
+        """
+        Returns the GDS script in `path`, as a `formats.gds.GDS`.
+        """
+        from formats.gds import GDS
+
+        def load():
+            data = self.read(path)
+            # The parsed commands take up a lot more than the file does
+            return GDS(data), len(data) * 8
+        return self.cache.get(self._key("gds", path), load)
+
+    def pcm(self, path):
+        """
+        Returns the PCM archive in `path` (compressed or not), as a `formats.pcm.PCM`.
+        """
+        from formats import pcm
+
+        def load():
+            archive = pcm.PCM(pcm.load(self.read(path)))
+            return archive, len(archive.file)
+        return self.cache.get(self._key("pcm", path), load)
+
+    def pcm_file(self, path, name):
+        """
+        Returns the contents of the file called `name` inside the PCM archive in `path`.
+        """
+        return self.pcm(path)[name]
+
+    def bg(self, path, full_range = False):
+        """
+        Returns the BG in `path`, as an indexed PIL image (see `formats.bg.to_image`).
+        """
+        from formats import bg
+
+        def load():
+            img = bg.to_image(self.read(path), full_range)
+            return img, img.size[0] * img.size[1]
+        return self.cache.get(self._key("bg", path, full_range), load)
+
+    def ani(self, path):
+        """
+        Returns the ANI sprite in `path`, as a `formats.ani.ANI` (whose images are decoded on demand).
+        """
+        from formats import ani
+
+        def load():
+            sprite = ani.ANI(self.read(path))
+            return sprite, len(sprite.data)
+        return self.cache.get(self._key("ani", path), load)
+
+# Shared by the projects of the CLI commands, so that a long-running process (like `flora serve`) decodes each file only once
+_file_cache = LRUCache()
+
+def open_file(path):
+    """
+    Returns a project for the directory of a file, and the file's name in it, for commands that work on single files.
+    All of these projects share one cache.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    return Project(directory, cache=_file_cache), name
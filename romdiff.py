@@ -0,0 +1,150 @@
+import click
+import concurrent.futures
+import hashlib
+import json
+import os
+
+from formats import ndsrom
+from timings import span
+from utils import cache_dir
+
+def file_hashes(rom, jobs = None):
+    """
+    Returns the size and SHA-1 of every file in the ROM, as {path: [size, hash]}.
+    Files are read straight from a memory-mapped ROM and hashed in parallel threads (hashlib releases the GIL for big inputs).
+    Results are cached by the ROM's hash.
+    """
+    cache = os.path.join(cache_dir("hashes"), ndsrom.rom_hash(rom) + ".json")
+    if os.path.exists(cache):
+        return json.load(open(cache, encoding="utf-8"))
+
+    with ndsrom.map_rom(rom) as data:
+        files = ndsrom.rom_files(data)
+        view = memoryview(data)
+        def hash_file(f):
+            path, start, end = f
+            with view[start:end] as contents:
+                return path, [end - start, hashlib.sha1(contents).hexdigest()]
+        with span("diff.hash", sum(end - start for _, start, end in files)):
+            # Biggest files first, so that one of them doesn't end up running alone at the end
+            with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+                out = dict(pool.map(hash_file, sorted(files, key=lambda f: f[1] - f[2])))
+        view.release()
+
+    with open(cache + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(out, f)
+    os.replace(cache + ".tmp", cache)
+    return out
+
+def diff_hashes(a, b):
+    """
+    Compares the file hashes of two ROMs (see `file_hashes`). Returns a dict with:
+    - "modified": paths in both ROMs whose contents differ
+    - "moved": (old path, new path) pairs of files that are only in one ROM each, but have the same contents
+    - "removed" / "added": paths only in the first / second ROM (that weren't moved)
+    - "unchanged": the number of files with the same path and contents
+    """
+    modified = sorted(p for p in a.keys() & b.keys() if a[p] != b[p])
+    removed = sorted(a.keys() - b.keys())
+    added = sorted(b.keys() - a.keys())
+
+    by_hash = {}
+    for path in added:
+        by_hash.setdefault(tuple(b[path]), []).append(path)
+    moved = []
+    for path in removed:
+        candidates = by_hash.get(tuple(a[path]))
+        if candidates:
+            moved.append((path, candidates.pop(0)))
+    moved_from = {old for old, _ in moved}
+    moved_to = {new for _, new in moved}
+
+    return {
+        "modified": modified,
+        "moved": moved,
+        "removed": [p for p in removed if p not in moved_from],
+        "added": [p for p in added if p not in moved_to],
+        "unchanged": len(a.keys() & b.keys()) - len(modified),
+    }
+
+def deep_diff(old, new):
+    """
+    Compares two versions of a PCM or GDS file, returning a list of lines describing what changed inside it
+    (or None if they aren't both PCMs or both GDS scripts).
+    """
+    from formats import pcm
+    from formats.gds import GDS
+    from formats.gdsdiff import diff_lines
+    from scan import sniff
+
+    old_format, new_format = sniff("", old)["format"], sniff("", new)["format"]
+    if old_format != new_format:
+        return None
+    if old_format == "pcm":
+        old_pcm, new_pcm = pcm.PCM(pcm.load(bytes(old))), pcm.PCM(pcm.load(bytes(new)))
+        out = []
+        for name in sorted(old_pcm.offsets.keys() | new_pcm.offsets.keys()):
+            if name not in new_pcm.offsets:
+                out.append(f"D {name}")
+            elif name not in old_pcm.offsets:
+                out.append(f"A {name}")
+            elif old_pcm[name] != new_pcm[name]:
+                out.append(f"M {name}")
+        return out
+    if old_format == "gds":
+        return diff_lines(GDS(bytes(old)).cmds, GDS(bytes(new)).cmds, context=1)
+    return None
+
+@click.command(
+                name = "diff",
+                no_args_is_help = True,
+                options_metavar = "[options]"
+            )
+@click.argument("rom_a", type=click.Path(exists=True, dir_okay=False))
+@click.argument("rom_b", type=click.Path(exists=True, dir_okay=False))
+@click.option("--deep", "-d", is_flag=True, help="Also show which files changed inside modified PCMs, and which commands changed inside modified GDS scripts.")
+@click.option("--json", "as_json", is_flag=True, help="Output the differences as JSON.")
+@click.option("--jobs", "-j", type=int, default=None, help="Number of threads used to hash the files.")
+def cli(rom_a, rom_b, deep = False, as_json = False, jobs = None):
+    """
+    Lists the files that differ between two ROMs, such as two regions or revisions of a game, comparing them by path and by contents,
+    so that files that were moved or renamed are also found.
+
+    Lines start with M (modified), R (moved/renamed), D (only in ROM_A) or A (only in ROM_B).
+    File hashes are cached per ROM, so comparing the same ROMs again is instant.
+    """
+    diff = diff_hashes(file_hashes(rom_a, jobs), file_hashes(rom_b, jobs))
+
+    details = {}
+    if deep and diff["modified"]:
+        with ndsrom.map_rom(rom_a) as data_a, ndsrom.map_rom(rom_b) as data_b:
+            files_a = {path: (start, end) for path, start, end in ndsrom.rom_files(data_a)}
+            files_b = {path: (start, end) for path, start, end in ndsrom.rom_files(data_b)}
+            for path in diff["modified"]:
+                (start_a, end_a), (start_b, end_b) = files_a[path], files_b[path]
+                try:
+                    lines = deep_diff(data_a[start_a:end_a], data_b[start_b:end_b])
+                except Exception as e:
+                    lines = [f"(couldn't compare the contents: {e})"]
+                if lines is not None:
+                    details[path] = lines
+
+    if as_json:
+        diff["moved"] = [{"from": old, "to": new} for old, new in diff["moved"]]
+        if deep:
+            diff["details"] = details
+        print(json.dumps(diff, indent=4, ensure_ascii=False))
+        return
+
+    for path in diff["modified"]:
+        print(f"M {path}")
+        for line in details.get(path, []):
+            print(f"    {line}")
+    for old, new in diff["moved"]:
+        print(f"R {old} -> {new}")
+    for path in diff["removed"]:
+        print(f"D {path}")
+    for path in diff["added"]:
+        print(f"A {path}")
+    print(f"{len(diff['modified'])} modified, {len(diff['moved'])} moved, {len(diff['removed'])} only in {os.path.basename(rom_a)}, "
+          f"{len(diff['added'])} only in {os.path.basename(rom_b)}, {diff['unchanged']} unchanged.")
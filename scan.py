@@ -0,0 +1,243 @@
+import click
+import concurrent.futures
+import csv
+import json
+import mmap
+import os
+import sys
+
+from formats import ndsrom
+from timings import span
+from utils import cache_dir
+from version import v
+
+# Compression type byte (the first byte of compressed data) -> name
+COMPRESSION = {0x10: "lz10", 0x11: "lz11", 0x24: "huffman", 0x28: "huffman", 0x30: "rle"}
+
+FIELDS = ("path", "format", "compression", "size", "decompressed_size", "members", "width", "height", "colors", "anomalies")
+
+def _u16(data, offset):
+    return int.from_bytes(data[offset:offset+2], "little")
+
+def _u32(data, offset):
+    return int.from_bytes(data[offset:offset+4], "little")
+
+def pcm_info(data, row):
+    """
+    Reads the headers of an (uncompressed) PCM file without asking about nonstandard attributes, noting them as anomalies instead.
+    """
+    h_size, file_size, num_files = _u32(data, 0), _u32(data, 4), _u32(data, 8)
+    if h_size != 0x10:
+        row["anomalies"].append(f"header_size={h_size}")
+    if file_size > len(data):
+        row["anomalies"].append(f"file_size={file_size} is past the end of the data")
+        file_size = len(data)
+    offset = h_size
+    members = 0
+    while offset < file_size:
+        m_h_size, m_size, reserved = _u32(data, offset), _u32(data, offset+4), _u32(data, offset+8)
+        name = bytes(data[offset+16:offset+m_h_size]).split(b"\x00")[0].decode("ascii", "replace")
+        if m_h_size != 0x20:
+            row["anomalies"].append(f"{name}: header_size={m_h_size}")
+        if reserved != 0:
+            row["anomalies"].append(f"{name}: reserved={reserved}")
+        if m_size % 0x10 != 0:
+            row["anomalies"].append(f"{name}: improper padding")
+        if m_size == 0:
+            row["anomalies"].append(f"{name}: empty member header, stopped reading")
+            break
+        members += 1
+        offset += m_size
+    if members != num_files:
+        row["anomalies"].append(f"num_files={num_files}, but {members} files were found")
+    row["format"] = "pcm"
+    row["members"] = members
+
+def bg_info(data, row):
+    """
+    Fills in the info of a BG's decompressed data. Returns False if the data doesn't look like a BG.
+    """
+    p_len = _u32(data, 0)
+    c = 4 + p_len*2
+    num_tiles = _u32(data, c)
+    c += 4 + num_tiles*0x40
+    width, height = _u16(data, c), _u16(data, c+2)
+    end = c + 4 + width*height*2
+    if p_len > 256 or num_tiles > 0x400 or end > len(data):
+        return False
+    if end != len(data):
+        row["anomalies"].append(f"{len(data) - end} extra bytes after the tile map")
+    row.update(format="bg", members=num_tiles, width=width*8, height=height*8, colors=p_len)
+    return True
+
+def ani_info(data, row):
+    """
+    Fills in the info of an ANI's decompressed data (see `formats.ani.ANI.parse`). Returns False if the data doesn't look like an ANI.
+    """
+    num_images, color_format = _u16(data, 0), _u16(data, 2)
+    if color_format not in (3, 4):
+        return False
+    bpp = 4 if color_format == 3 else 8
+    c = 4
+    for _ in range(num_images):
+        num_parts = _u16(data, c+4)
+        c += 8
+        for _ in range(num_parts):
+            c += 8 + (8 << _u16(data, c+4)) * (8 << _u16(data, c+6)) * bpp // 8
+            if c > len(data):
+                return False
+    if c + 4 > len(data):
+        return False
+    row.update(format="ani", members=num_images, colors=_u32(data, c))
+    return True
+
+def gds_info(data, row):
+    from formats.gds import GDS
+
+    row["format"] = "gds"
+    try:
+        row["members"] = len(GDS(bytes(data)).cmds)
+    except Exception as e:
+        row["anomalies"].append(str(e))
+
+def sniff(path, data):
+    """
+    Detects the format of a single file from its contents (by magic, compression type byte and length prefix), and returns its info as a dict.
+    """
+    from formats import compression
+
+    row = dict.fromkeys(FIELDS)
+    row.update(path=path, format="unknown", size=len(data), anomalies=[])
+    if len(data) >= 6 and _u32(data, 0) == len(data) - 4:
+        gds_info(data, row)
+    elif data[12:16] == b"LPCK":
+        pcm_info(data, row)
+    elif len(data) >= 8 and data[4] in COMPRESSION:
+        # ARC: a 4-byte header, and then compressed data
+        row["compression"] = COMPRESSION[data[4]]
+        row["decompressed_size"] = _u32(data, 4) >> 8
+        try:
+            content = compression.decompress(bytes(data[4:]))
+        except NotImplementedError:
+            row["format"] = "arc"
+            row["anomalies"].append(f"{row['compression']} decompression isn't supported")
+            return row
+        except Exception:
+            content = None
+        if content is None or not (bg_info(content, row) or ani_info(content, row)):
+            # Not an ARC after all, so it might be a compressed PCM
+            row.update(format="unknown", compression=None, decompressed_size=None, anomalies=[])
+    if row["format"] == "unknown" and len(data) >= 4 and data[0] in COMPRESSION:
+        try:
+            content = compression.decompress(bytes(data))
+        except Exception:
+            content = b""
+        if content[12:16] == b"LPCK":
+            row["compression"] = COMPRESSION[data[0]]
+            row["decompressed_size"] = len(content)
+            pcm_info(content, row)
+    return row
+
+# Every worker maps the ROM once, and is then given the position of the files to scan
+_worker_rom = None
+
+def _init_worker(rom):
+    global _worker_rom
+    f = open(rom, "rb")
+    _worker_rom = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _scan_files(files):
+    with span("scan.sniff") as s:
+        out = []
+        for path, start, end in files:
+            out.append(sniff(path, memoryview(_worker_rom)[start:end]))
+            s.add(end - start)
+    return out
+
+def scan(rom, jobs = None, refresh = False):
+    """
+    Returns the info of every file in the ROM (see `sniff`), scanning them in parallel.
+    Results are cached by the ROM's hash, so scanning the same ROM again is instant (unless `refresh` is set).
+    """
+    cache = os.path.join(cache_dir("scan"), ndsrom.rom_hash(rom) + ".json")
+    if not refresh and os.path.exists(cache):
+        cached = json.load(open(cache, encoding="utf-8"))
+        if cached["version"] == v:
+            return cached["files"]
+
+    with ndsrom.map_rom(rom) as data:
+        files = ndsrom.rom_files(data)
+
+    # Split the files into batches of roughly the same size, so that big files don't end up in the same worker
+    batches = [[]]
+    batch_size = 0
+    for f in sorted(files, key=lambda f: f[1]):
+        batches[-1].append(f)
+        batch_size += f[2] - f[1]
+        if batch_size >= 1 << 20:
+            batches.append([])
+            batch_size = 0
+
+    out = []
+    with concurrent.futures.ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(rom,)) as pool:
+        for rows in pool.map(_scan_files, batches):
+            out += rows
+    out.sort(key=lambda row: row["path"])
+
+    with open(cache + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": v, "files": out}, f)
+    os.replace(cache + ".tmp", cache)
+    return out
+
+def _matches(row, filters):
+    for key, value in filters:
+        if key == "anomalies":
+            if not any(value.lower() in a.lower() for a in row["anomalies"]):
+                return False
+        elif str(row[key]).lower() != value.lower():
+            return False
+    return True
+
+@click.command(
+                name = "scan",
+                no_args_is_help = True,
+                options_metavar = "[options]"
+            )
+@click.argument("rom", type=click.Path(exists=True, dir_okay=False))
+@click.option("--output", "-o", type=click.Path(dir_okay=False), default=None, help="File to write the inventory to. Defaults to stdout.")
+@click.option("--format", "-f", "format_", type=click.Choice(["csv", "json"]), default=None, help="Output format. Defaults to the output file's extension, or CSV.")
+@click.option("--where", "-w", multiple=True, metavar="KEY=VALUE", help="Only list files where KEY is VALUE (e.g. format=pcm, compression=huffman). For 'anomalies', VALUE is searched in every anomaly; use 'anomalies=' to list files with any anomaly.")
+@click.option("--sort", "-s", type=click.Choice(FIELDS), default=None, help="Sort the files by this field.")
+@click.option("--reverse", is_flag=True, help="Sort in descending order.")
+@click.option("--jobs", "-j", type=int, default=None, help="Number of worker processes. Defaults to the number of CPUs.")
+@click.option("--refresh", is_flag=True, help="Scan the ROM again, even if its inventory is cached.")
+def cli(rom, output = None, format_ = None, where = (), sort = None, reverse = False, jobs = None, refresh = False):
+    """
+    Lists every file in the ROM, with its format (detected from its contents), compression, size, decompressed size,
+    number of members (files in a PCM, images in an ANI, tiles in a BG, commands in a GDS script) and anything unusual about it.
+    """
+    filters = []
+    for w in where:
+        key, sep, value = w.partition("=")
+        if not sep or key not in FIELDS:
+            raise Exception(f"Invalid filter '{w}': must be KEY=VALUE, with KEY one of {', '.join(FIELDS)}")
+        filters.append((key, value))
+
+    rows = [row for row in scan(rom, jobs, refresh) if _matches(row, filters)]
+    if sort is not None:
+        # Files without a value for the field always go last
+        rows = sorted((row for row in rows if row[sort] is not None), key=lambda row: row[sort], reverse=reverse) + [row for row in rows if row[sort] is None]
+
+    if format_ is None:
+        format_ = "json" if output is not None and output.lower().endswith(".json") else "csv"
+    f = open(output, "w", encoding="utf-8", newline="") if output is not None else sys.stdout
+    if format_ == "json":
+        json.dump(rows, f, indent=4)
+        f.write("\n")
+    else:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, anomalies="; ".join(row["anomalies"])))
+    if output is not None:
+        f.close()
@@ -0,0 +1,189 @@
+import click
+import concurrent.futures
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import socketserver
+import sys
+import threading
+
+from client import DEFAULT_SOCKET
+from utils import load_data
+
+def init_worker():
+    # Warm up the worker: import every format module and read the data tables once, instead of once per command
+    import formats.bg, formats.gds, formats.pcm, formats.puzzle
+    for table in ("commands", "puzzles", "titles", "fingerprints"):
+        load_data(table)
+    # Commands that ask for confirmation shouldn't block the worker (or read from the server's stdin)
+    sys.stdin = open(os.devnull)
+
+def run_command(args, cwd):
+    """
+    Runs a single Flora command (the arguments that would be given to main.py) inside a worker, and returns its exit code
+    and what it wrote to stdout and stderr (kept apart, so the client can write each one to the same stream as main.py would).
+    """
+    from main import cli
+
+    if args[:1] == ["serve"]:
+        return {"exit_code": 1, "stdout": "", "stderr": "Error: can't start a server from inside the server.\n"}
+
+    os.chdir(cwd)
+    out = io.StringIO()
+    err = io.StringIO()
+    exit_code = 0
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            rv = cli.main(args, prog_name="flora", standalone_mode=False)
+            if isinstance(rv, int):
+                exit_code = rv
+        except click.ClickException as e:
+            e.show()
+            exit_code = e.exit_code
+        except click.Abort:
+            print("Aborted!", file=sys.stderr)
+            exit_code = 1
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            print(f"Error: {e}", file=sys.stderr)
+            exit_code = 1
+    return {"exit_code": exit_code, "stdout": out.getvalue(), "stderr": err.getvalue()}
+
+class Server:
+    def __init__(self, jobs = None):
+        # The socket server handles requests in threads, and forking a multi-threaded process can deadlock,
+        # so workers are started by a fork server (or spawned, where there's no fork server, like on Windows)
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, mp_context=multiprocessing.get_context(method))
+        self.running = True
+
+    def submit(self, message):
+        """
+        Handles a JSON-RPC request. Returns a future for the response, or None if no response should be sent (notifications).
+        """
+        result = concurrent.futures.Future()
+        def error(id, code, message):
+            result.set_result({"jsonrpc": "2.0", "id": id, "error": {"code": code, "message": message}})
+            return result
+
+        try:
+            request = json.loads(message)
+        except json.JSONDecodeError as e:
+            return error(None, -32700, f"Parse error: {e}")
+        # Malformed requests get an error response (even without an id), instead of taking the server down
+        if not isinstance(request, dict):
+            return error(None, -32600, "Invalid request: not a JSON object")
+        id = request.get("id")
+        method = request.get("method")
+        params = request.get("params", {})
+        if not isinstance(method, str):
+            return error(id, -32600, "Invalid request: 'method' must be a string")
+        if not isinstance(params, dict):
+            return error(id, -32602, "Invalid params: 'params' must be an object")
+
+        if method == "run":
+            args, cwd = params.get("args"), params.get("cwd", os.getcwd())
+            if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+                return error(id, -32602, "Invalid params: 'args' must be a list of strings")
+            if not isinstance(cwd, str):
+                return error(id, -32602, "Invalid params: 'cwd' must be a string")
+            job = self.pool.submit(run_command, args, cwd)
+            def done(job):
+                try:
+                    result.set_result({"jsonrpc": "2.0", "id": id, "result": job.result()})
+                except Exception as e:
+                    result.set_result({"jsonrpc": "2.0", "id": id, "error": {"code": -32000, "message": str(e)}})
+            job.add_done_callback(done)
+        elif method == "ping":
+            result.set_result({"jsonrpc": "2.0", "id": id, "result": "pong"})
+        elif method == "shutdown":
+            self.running = False
+            result.set_result({"jsonrpc": "2.0", "id": id, "result": None})
+        else:
+            result.set_result({"jsonrpc": "2.0", "id": id, "error": {"code": -32601, "message": f"Unknown method '{method}'"}})
+
+        if "id" not in request:
+            return None
+        return result
+
+    def serve_stdio(self):
+        lock = threading.Lock()
+        def respond(future):
+            with lock:
+                sys.stdout.write(json.dumps(future.result()) + "\n")
+                sys.stdout.flush()
+
+        pending = []
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            future = self.submit(line)
+            if future is not None:
+                future.add_done_callback(respond)
+                pending.append(future)
+            if not self.running:
+                break
+        concurrent.futures.wait(pending)
+
+    def serve_socket(self, path):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    future = server.submit(line)
+                    if future is not None:
+                        self.wfile.write(json.dumps(future.result()).encode("utf-8") + b"\n")
+                    if not server.running:
+                        threading.Thread(target=unix_server.shutdown).start()
+                        break
+
+        class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        if os.path.exists(path):
+            os.remove(path)
+        unix_server = ThreadingUnixServer(path, Handler)
+        try:
+            unix_server.serve_forever()
+        finally:
+            unix_server.server_close()
+            os.remove(path)
+
+    def close(self):
+        self.pool.shutdown()
+
+@click.command(
+                name="serve",
+                options_metavar="[options]"
+            )
+@click.option("--socket", "socket_path", is_flag=False, flag_value=DEFAULT_SOCKET, default=None, metavar="PATH",
+                help=f"Listen on a Unix socket (by default {DEFAULT_SOCKET}) instead of reading requests from stdin.")
+@click.option("--jobs", "-j", type=int, default=None, help="Number of worker processes. Defaults to the number of CPUs.")
+def cli(socket_path = None, jobs = None):
+    """
+    Runs a persistent Flora server, which keeps the format modules, data tables and recently loaded ROMs warm between commands.
+
+    Requests are JSON-RPC 2.0 messages, one per line. The method "run" takes the parameters {"args": [...], "cwd": "..."},
+    where args are the same arguments that would be given to Flora on the command line, and returns {"exit_code": ..., "stdout": "...", "stderr": "..."}.
+    "ping" and "shutdown" are also available. Requests are run concurrently on a pool of worker processes.
+
+    By default requests are read from stdin and responses written to stdout. With --socket, the server listens on a Unix socket instead,
+    which client.py connects to (e.g. `python client.py gds create script.json script.gds`).
+    """
+    server = Server(jobs)
+    try:
+        if socket_path is None:
+            server.serve_stdio()
+        else:
+            print(f"Listening on {socket_path}", file=sys.stderr)
+            server.serve_socket(socket_path)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
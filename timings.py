@@ -0,0 +1,72 @@
+'''Lightweight timing spans, used to diagnose slow commands with `flora --timings`'''
+import contextlib
+import time
+
+enabled = False
+spans = {} # name -> {"count", "seconds", "bytes"}
+_start = None
+
+class Span:
+    def __init__(self, nbytes = 0):
+        self.bytes = nbytes
+
+    def add(self, nbytes):
+        """
+        Counts `nbytes` more bytes as processed by this span (for when the amount isn't known when the span starts).
+        """
+        self.bytes += nbytes
+
+class _DisabledSpan(Span):
+    # What span() gives when recording is off: counting bytes does nothing
+    def add(self, nbytes):
+        pass
+
+_disabled_span = _DisabledSpan()
+
+def start():
+    """
+    Clears any previous measurements and starts recording spans.
+    """
+    global enabled, _start
+    spans.clear()
+    enabled = True
+    _start = time.perf_counter()
+
+def stop():
+    global enabled
+    enabled = False
+
+@contextlib.contextmanager
+def span(name, nbytes = 0):
+    """
+    Measures the wall time spent inside the `with` block, and the amount of bytes it processed, under the stage `name`.
+    Does nothing unless recording has been started.
+
+    Spans can be nested; the time of a span includes the time of any spans inside it.
+    """
+    if not enabled:
+        yield _disabled_span
+        return
+    s = Span(nbytes)
+    begin = time.perf_counter()
+    try:
+        yield s
+    finally:
+        elapsed = time.perf_counter() - begin
+        stats = spans.setdefault(name, {"count": 0, "seconds": 0.0, "bytes": 0})
+        stats["count"] += 1
+        stats["seconds"] += elapsed
+        stats["bytes"] += s.bytes
+
+def summary():
+    """
+    Returns the recorded measurements, as a JSON-compatible dict.
+    """
+    stages = {}
+    for name, stats in sorted(spans.items(), key=lambda s: -s[1]["seconds"]):
+        stages[name] = dict(stats)
+        stages[name]["mb_per_s"] = stats["bytes"] / stats["seconds"] / 1e6 if stats["bytes"] and stats["seconds"] else None
+    return {
+        "total_seconds": time.perf_counter() - _start if _start is not None else 0.0,
+        "stages": stages,
+    }
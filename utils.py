@@ -1,5 +1,69 @@
+import click
+import functools
+import importlib
+import json
 import os
 
+data_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "data")
+
+@functools.lru_cache(maxsize=None)
+def load_data(name):
+    """
+    Loads one of the JSON tables in the `data` directory (e.g. `load_data("commands")`).
+
+    The tables are only read the first time they're needed, and the result is cached for the rest of the run.
+    """
+    with open(os.path.join(data_path, f"{name}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+def cache_dir(name):
+    """
+    Returns the directory where Flora keeps the cache called `name`, creating it if needed.
+    Caches are kept in $FLORA_CACHE if set, or otherwise in ~/.cache/flora.
+    """
+    root = os.environ.get("FLORA_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "flora"))
+    path = os.path.join(root, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+class LazyGroup(click.Group):
+    """
+    A click group that only imports the modules of its subcommands when they're actually used.
+
+    `lazy_commands` maps each subcommand name to a tuple `(import_path, short_help)`, where `import_path` looks like `"module:attribute"`.
+    The short help is kept here so that listing the subcommands (e.g. `flora --help`) doesn't need to import any of them.
+    """
+
+    def __init__(self, *args, lazy_commands = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, name):
+        if name not in self.commands and name in self.lazy_commands:
+            module, attr = self.lazy_commands[name][0].split(":")
+            self.add_command(getattr(importlib.import_module(module), attr), name)
+        return super().get_command(ctx, name)
+
+    def format_commands(self, ctx, formatter):
+        names = self.list_commands(ctx)
+        if not names:
+            return
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = []
+        for name in names:
+            if name in self.commands:
+                cmd = self.commands[name]
+                if cmd.hidden:
+                    continue
+                rows.append((name, cmd.get_short_help_str(limit)))
+            else:
+                rows.append((name, click.utils.make_default_short_help(self.lazy_commands[name][1], limit)))
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
 def cli_file_pairs(input = None, output = None, *, in_ending = None, out_ending = None, recursive = False):
     """
     Given the file path inputs to the various CLI commands, determines which input files should be operated on and mapped to which output files.
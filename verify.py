@@ -0,0 +1,117 @@
+import click
+import json
+import os
+
+from formats import ndsrom
+from formats.ndsrom import rom_info, tables_hash
+from romdiff import file_hashes
+from utils import data_path, load_data
+
+# The database has one entry per known clean dump, by the SHA-1 of the whole ROM:
+# {"roms": {sha1: {"name", "id", "version", "size", "tables", "files": {path: [size, sha1]}}}}
+# "tables" is the SHA-1 of the header, FNT and FAT, for quick checks.
+DATABASE = os.path.join(data_path, "fingerprints.json")
+
+def fingerprint(rom, name = "", jobs = None):
+    """
+    Makes the database entry of a ROM, returning its key (the ROM's hash) and the entry.
+    """
+    with ndsrom.map_rom(rom) as data:
+        id, version = rom_info(data)
+        tables = tables_hash(data)
+        size = len(data)
+    return ndsrom.rom_hash(rom), {
+        "name": name,
+        "id": id,
+        "version": version,
+        "size": size,
+        "tables": tables,
+        "files": file_hashes(rom, jobs),
+    }
+
+def verify(rom, quick = False, jobs = None, database = None):
+    """
+    Checks a ROM against the clean dumps in the fingerprint database. Returns a dict with:
+    - "status": "clean", "modified", or "unknown" (no clean dump of the same game and revision is known)
+    - "match": the name of the clean dump it was compared to (if any)
+    - "modified", "missing" and "added": the files that differ from the clean dump
+
+    With `quick`, only the header, FNT and FAT are read: the whole ROM isn't hashed, and files are compared by size only,
+    so a file that was changed without changing its size isn't found.
+    """
+    if quick:
+        return ndsrom.quick_verify(rom, database)
+    if database is None:
+        database = load_data("fingerprints")
+    with ndsrom.map_rom(rom) as data:
+        candidates = ndsrom.clean_dumps(data, database)
+    if not candidates:
+        return {"status": "unknown", "match": None, "modified": [], "missing": [], "added": []}
+    digest = ndsrom.rom_hash(rom)
+    if digest in candidates:
+        return {"status": "clean", "match": candidates[digest]["name"], "modified": [], "missing": [], "added": []}
+    return ndsrom.closest_dump(candidates, file_hashes(rom, jobs))
+
+def record(rom, name, database_path = DATABASE, jobs = None, assume_yes = False):
+    """
+    Adds a ROM to the fingerprint database, as a clean dump.
+    """
+    database = {"roms": {}}
+    if os.path.exists(database_path):
+        database = json.load(open(database_path, encoding="utf-8"))
+    key, entry = fingerprint(rom, name, jobs)
+    if key in database["roms"] and not assume_yes:
+        ans = input(f"This ROM is already in the database (as '{database['roms'][key]['name']}'). Replace it? (y/N) ")
+        if ans.lower() != "y":
+            return False
+    database["roms"][key] = entry
+    with open(database_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(database, f, indent=4)
+    os.replace(database_path + ".tmp", database_path)
+    load_data.cache_clear()
+    return True
+
+@click.command(
+                name = "verify",
+                no_args_is_help = True,
+                options_metavar = "[options]"
+            )
+@click.argument("rom", type=click.Path(exists=True, dir_okay=False))
+@click.option("--quick", is_flag=True, help="Only read the header, FNT and FAT, comparing files by size. Much faster, but misses files that were changed without changing their size.")
+@click.option("--record", "record_name", default=None, metavar="NAME", help="Add this ROM to the fingerprint database as a clean dump called NAME, instead of verifying it.")
+@click.option("--database", type=click.Path(dir_okay=False), default=None, help="Fingerprint database to use, instead of the one shipped with Flora.")
+@click.option("--json", "as_json", is_flag=True, help="Output the result as JSON.")
+@click.option("--assume-yes", "-y", is_flag=True, help="Don't ask for confirmation (e.g. before replacing a database entry with --record).")
+@click.option("--jobs", "-j", type=int, default=None, help="Number of threads used to hash the files.")
+def cli(rom, quick = False, record_name = None, database = None, as_json = False, assume_yes = False, jobs = None):
+    """
+    Checks whether a ROM is a clean dump, by comparing it with the fingerprints of known clean dumps.
+    If it isn't, lists the files that were modified, removed (missing) or added.
+
+    Exits with code 1 if the ROM was modified, and 2 if no clean dump of the same game and revision is known.
+    """
+    if record_name is not None:
+        if record(rom, record_name, database or DATABASE, jobs, assume_yes):
+            print(f"Added {os.path.basename(rom)} to the fingerprint database as '{record_name}'.")
+        return
+
+    db = json.load(open(database, encoding="utf-8")) if database is not None else None
+    result = verify(rom, quick, jobs, db)
+    if as_json:
+        print(json.dumps(result, indent=4))
+    elif result["status"] == "unknown":
+        print("No clean dump of this game and revision is known, so the ROM can't be verified.")
+    elif result["status"] == "clean":
+        print(f"Clean: matches {result['match']}.")
+    else:
+        print(f"Modified: differs from {result['match']}.")
+        for key, letter in (("modified", "M"), ("missing", "D"), ("added", "A")):
+            for path in result[key]:
+                print(f"{letter} {path}")
+        if not (result["modified"] or result["missing"] or result["added"]):
+            if quick:
+                print("No file changed its size; run without --quick to find which files changed.")
+            else:
+                print("All files are the same, so the difference is in the header, code or banner.")
+    if result["status"] != "clean":
+        raise SystemExit(1 if result["status"] == "modified" else 2)